@@ -8,8 +8,10 @@
 This program will read the files in a designated folder (with allowed extensions) and upload them to your TV. It keeps track of which files correspond to what
 content_id on your TV by saving the data in a file called uploaded_files.json. it also keeps track of when the selected artwork was last changed.
 
-It monitors the folder for changes every check seconds (5 by default), new files are uploaded to the TV, removed files are deleted from the TV, and if a file
+It monitors the folder for changes every check seconds (5 by default), or as soon as they happen on Linux (using inotify), new files are uploaded to the TV, removed files are deleted from the TV, and if a file
 is changed, the old content is removed from the TV and the new content uploaded to the TV. Content is only changed if the TV is in art mode.
+A hash of the content of each file is saved with the content_id, so renamed files, files that are touched but not changed, and duplicate
+files are not uploaded again.
 
 if check is set to 0 seconds, the program will run once and exit. You can then run it periodically (say with a cron job).
 
@@ -22,6 +24,9 @@ If the on (-O) option is selected, the program wil exit if the TV is not on (TV
 If the sequential (-S) option is selected, then the slideshow is sequential, not random (random is the default)
 The default checking period is 60 seconds or the update period whichever is less.
 
+Art mode, power and the current content_id are tracked from events pushed by the TV, with a slow reconciliation poll
+(every reconcile seconds) as a fallback, so the TV is not polled every second.
+
 It is loaded by the web_interface.py program
 '''
 
@@ -29,7 +34,6 @@ import sys
 import logging
 from pathlib import Path
 import sys
-import io
 import random, string
 import json
 import asyncio
@@ -38,10 +42,23 @@ import datetime
 from signal import SIGTERM, SIGINT
 HAVE_PIL = False
 try:
-    from PIL import Image, ImageFilter, ImageChops
+    from PIL import ImageChops, ImageStat
     HAVE_PIL=True
 except ImportError:
     pass
+from image_probe import ImageProbe, FRAME_SIZE, get_frame, fingerprint_data, frame_from_bytes
+from worker_pool import WorkerPool
+from file_cache import FileCache, get_stat_key, get_content_hash
+from hash_index import HashIndex
+from batch_compare import BatchCompare, HAVE_NUMPY
+from upload_pipeline import UploadPipeline
+from transcode import Transcoder
+from folder_watcher import FolderWatcher
+from state_store import StateStore
+from slideshow import SlideshowDeck
+from content_listing import ContentListing
+from tv_thumbnails import TVThumbnailCache
+from tv_scheduler import TVScheduler, INTERACTIVE, POLL, BULK
 
 from samsungtvws.async_art import SamsungTVAsyncArt
 from samsungtvws.async_remote import SamsungTVWSAsyncRemote
@@ -52,90 +69,205 @@ logging.basicConfig(level=logging.INFO)
     
 class PIL_methods:
     
+    match_distance = 4      #hash distance accepted as a match without confirming (if confirm is False)
+    confirm = True          #confirm near (not exact) hash matches by comparing frames
+    thumbnail_batch = 50    #max number of thumbnails downloaded from the tv at once
+    sync_batch = 20         #number of files compared at a time, matches are saved after each batch
+    
     def __init__(self, mon):
         self.log = logging.getLogger('Main.'+__class__.__name__)
         self.mon = mon
         self.folder = self.mon.folder
-        self.uploaded_files = self.mon.uploaded_files
+        self.tv_thumbnails = TVThumbnailCache() if HAVE_PIL else None
+        self.checkpoint = FileCache('sync') if HAVE_PIL else None
+        self.pending = set()    #files waiting to be syncronized, these are not uploaded until they have been checked
+        self.task = None
+        
+    @property
+    def uploaded_files(self):
+        return self.mon.uploaded_files
         
     async def initialize(self):
         '''
         initialize uploaded_files using PIL
         compares the file data with thumbnails to find the content_id and write to uploaded_files
         if it doesn't already exist
+        only files that are not in uploaded_files are checked, in batches, and matches are saved after each batch
+        files that have been checked are saved in a checkpoint, so if the program is restarted, the sync continues where it stopped
         '''
         if not HAVE_PIL:
             return
         self.log.info('Checking uploaded files list using PIL')
-        files_images = self.load_files()
-        if files_images:
+        files = await self.mon.get_folder_files()
+        self.checkpoint.prune(files)
+        self.checkpoint.commit()
+        files = [f for f in files if f not in self.uploaded_files.keys() and not self.is_checked(f)]
+        if files:
+            self.pending = set(files)
+            self.task = asyncio.create_task(self.sync_files(files))
+        else:
+            self.log.info('no new files, using origional uploaded files list')
+            
+    async def sync_files(self, files):
+        '''
+        background task to find files on the tv
+        '''
+        try:
             self.log.info('getting My Photos list')
-            my_photos = await self.mon.get_tv_content('MY-C0002')
-            if my_photos is not None and len(my_photos) > 0:
-                await self.check_thumbnails(files_images, my_photos)
+            my_photos = await self.mon.get_tv_content('MY-C0002', refresh=True)
+            if my_photos is not None:
+                #only remove thumbnails of content that is no longer on the tv, not content that is already matched
+                self.tv_thumbnails.prune(my_photos)
+                self.tv_thumbnails.commit()
+            #content already matched to a file doesn't need to be checked again
+            content_ids = {v['content_id'] for v in self.uploaded_files.values()}
+            my_photos = [c for c in my_photos or [] if c not in content_ids]
+            if my_photos:
+                await self.check_thumbnails(files, my_photos)
             else:
-                self.log.info('no photos found on tv')
-        else:
-            self.log.info('no files, using origional uploaded files list')
+                self.log.info('no new photos found on tv')
+            self.log.info('syncronizing finished')
+        except Exception as e:
+            self.log.warning('error syncronizing: {}'.format(e))
+        finally:
+            self.pending = set()
+            self.checkpoint.commit()
+        
+    def is_checked(self, filename):
+        '''
+        True if file has already been checked against the tv (and has not changed since)
+        '''
+        try:
+            return self.checkpoint.get(filename, get_stat_key(Path(self.folder, filename))) is not None
+        except OSError:
+            return False
             
-    async def check_thumbnails(self, files_images, my_photos):
+    async def check_thumbnails(self, files, my_photos):
         '''
-        download thumbnails from my_photos to compare with file data
-        save any updates
+        get thumbnails from my_photos to compare with files, in batches of sync_batch files
+        save any updates and checkpoint after each batch
+        the time spent comparing is limited to sync_budget (fraction of time), so the rest of the program keeps running
         '''
-        self.log.info('downloading My Photos thumbnails, please wait...')
-        my_photos_thumbnails = await self.mon.get_thumbnails(my_photos)
-        if my_photos_thumbnails:
-            self.log.info('checking thumbnails against {} files, please wait...'.format(len(files_images)))
-            self.compare_thumbnails(files_images, my_photos_thumbnails)
-            self.mon.write_program_data()
-        else:
+        thumbnails = await self.load_thumbnails(my_photos)
+        if not thumbnails:
             self.log.info('failed to get thumbnails')
+            return
+        self.log.info('checking thumbnails against {} files, please wait...'.format(len(files)))
+        batch_size = min(self.sync_batch, self.mon.probe.max_full)     #only one batch of file probes is held at a time
+        for i in range(0, len(files), batch_size):
+            start = time.time()
+            batch = files[i:i+batch_size]
+            files_images = await self.get_files_dict(batch)
+            await self.compare_thumbnails(files_images, thumbnails)
+            self.mon.write_program_data()
+            for file in files_images.keys():
+                try:
+                    self.checkpoint.put(file, get_stat_key(Path(self.folder, file)), self.uploaded_files.get(file, {}).get('content_id', ''))
+                except OSError as e:
+                    self.log.warning('{}: not checkpointed, {}'.format(file, e))   #file removed during sync
+            self.checkpoint.commit()
+            self.pending.difference_update(batch)
+            self.log.info('checked {} of {} files'.format(min(i+batch_size, len(files)), len(files)))
+            if self.mon.sync_budget < 1:
+                await asyncio.sleep((time.time() - start) * (1 - self.mon.sync_budget) / max(0.01, self.mon.sync_budget))
             
-    def compare_thumbnails(self, files_images, my_photos_thumbnails):
-        '''
-        compare file data with thumbnails to find a match, and update update_uploaded_files
-        '''
-        for k, (filename, file_data) in enumerate(files_images.items()):
-            for i, (my_content_id, my_data) in enumerate(my_photos_thumbnails.items()):
-                self.log_progress(len(files_images)*len(my_photos_thumbnails), k*len(files_images)+i)
-                self.log.debug('checking: {} against {}, thumbnail: {} bytes'.format(filename, my_content_id, len(my_data)))
-                if self.are_images_equal(Image.open(io.BytesIO(my_data)), file_data):
-                    self.log.info('found uploaded file: {} as {}'.format(filename, my_content_id))
-                    if filename not in self.uploaded_files.keys():
-                        self.mon.update_uploaded_files(filename, my_content_id)
-                    break
-        
-    def log_progress(self, total, count):
+    async def load_thumbnails(self, my_photos):
+        '''
+        returns dictionary of content_id and thumbnail fingerprint for my_photos
+        fingerprints are loaded from the thumbnail cache, only thumbnails that are not cached are downloaded from the tv
+        (in batches of thumbnail_batch)
+        '''
+        thumbnails = {my_content_id: self.tv_thumbnails.get(my_content_id) for my_content_id in my_photos if my_content_id in self.tv_thumbnails}
+        missing = [my_content_id for my_content_id in my_photos if my_content_id not in thumbnails]
+        self.log.info('{} thumbnails cached, {} to download'.format(len(thumbnails), len(missing)))
+        for i in range(0, len(missing), self.thumbnail_batch):
+            batch = missing[i:i+self.thumbnail_batch]
+            self.log.info('downloading My Photos thumbnails {}-{} of {}, please wait...'.format(i+1, i+len(batch), len(missing)))
+            my_photos_thumbnails = await self.mon.get_thumbnails(batch)
+            fingerprints = await self.fingerprint_thumbnails(my_photos_thumbnails)
+            for my_content_id, data in fingerprints.items():
+                self.tv_thumbnails.put(my_content_id, my_photos_thumbnails[my_content_id], data)
+            self.tv_thumbnails.commit()
+            thumbnails.update(fingerprints)
+        self.tv_thumbnails.commit()
+        return {k: v for k, v in thumbnails.items() if v}
+            
+    async def compare_thumbnails(self, files_images, thumbnails):
+        '''
+        compare file data with thumbnail fingerprints to find a match, and update update_uploaded_files
+        matches are looked up in a hash index
+        '''
+        if self.mon.compare == 'batch':
+            if HAVE_NUMPY:
+                return await self.batch_compare_thumbnails(files_images, thumbnails)
+            self.log.warning('numpy is not installed, using hash compare')
+        index = HashIndex()
+        for my_content_id, data in thumbnails.items():
+            index.add(my_content_id, data['hash'])
+        for filename, file_data in files_images.items():
+            my_content_id = self.find_match(file_data, thumbnails, index)
+            if my_content_id:
+                self.add_match(filename, my_content_id)
+                    
+    async def batch_compare_thumbnails(self, files_images, thumbnails):
+        '''
+        compare every file frame with every thumbnail frame using vectorized batch compare
+        gives the same matches as comparing each pair with are_frames_equal
+        runs in a worker thread (numpy releases the GIL, and this saves copying the frames to a process)
+        '''
+        matches = await self.mon.pool.run_io(BatchCompare().match,
+                                             {k:v['frame'] for k, v in files_images.items()},
+                                             {k:v['frame'] for k, v in thumbnails.items()})
+        for filename, my_content_id in matches.items():
+            self.add_match(filename, my_content_id)
+            
+    def add_match(self, filename, my_content_id):
         '''
-        log % progress every 10% if this will take a while
+        add file matched to content on the tv to uploaded_files, unless the file has been removed during the sync
         '''
-        if total >= 1000:
-            percent = min(100,(count*100)//total)
-            if count % (total//10) == 0:
-                self.log.info('{}% complete'.format(percent))
-        
-    def load_files(self):
+        self.log.info('found uploaded file: {} as {}'.format(filename, my_content_id))
+        if filename not in self.uploaded_files.keys():
+            try:
+                self.mon.update_uploaded_files(filename, my_content_id)
+            except OSError as e:
+                self.log.warning('{}: not added, {}'.format(filename, e))
+                    
+    async def fingerprint_thumbnails(self, my_photos_thumbnails):
         '''
-        reads folder files, and returns dictionary of filenames and binary data
-        only used if PIL is installed
+        returns dictionary of content_id and fingerprint for thumbnail data
+        thumbnails are decoded in the worker pool
         '''
-        files = self.mon.get_folder_files()
-        self.log.info('loading files: {}'.format(files))
-        files_images = self.get_files_dict(files)
-        self.log.info('loaded: {}'.format(list(files_images.keys())))
-        return files_images
+        return await self.mon.pool.map(lambda my_content_id: self.mon.pool.run_cpu(fingerprint_data, my_photos_thumbnails[my_content_id]),
+                                       list(my_photos_thumbnails.keys()))
         
-    def get_files_dict(self, files):
+    def find_match(self, file_data, thumbnails, index):
+        '''
+        find content_id of thumbnail matching file fingerprint, or None
+        exact hash matches are accepted, near matches are confirmed by comparing frames (if self.confirm)
+        '''
+        for distance, my_content_id in index.search(file_data['hash']):
+            self.log.debug('checking: {}, hash distance: {}'.format(my_content_id, distance))
+            if distance == 0:
+                return my_content_id
+            if self.confirm:
+                if self.are_frames_equal(frame_from_bytes(thumbnails[my_content_id]['frame']), frame_from_bytes(file_data['frame'])):
+                    return my_content_id
+            elif distance <= self.match_distance:
+                return my_content_id
+        return None
+        
+    async def get_files_dict(self, files):
         '''
-        makes a dictionary of filename and file binary data
+        makes a dictionary of filename and file probe data (format, size, exif, frame and hash) for one batch of files
+        the files are opened (and closed) in the workers, so no images or file handles are held here
         warns if file type given by extension is wrong
         only used if PIL is installed
         '''
         files_images = {}
+        probes = await self.mon.probe.aprobe_all([Path(self.folder, file) for file in files], full=True)
         for file in files:
             try:
-                data = Image.open(Path(self.folder, file))
+                data = probes[Path(self.folder, file)]
                 format = self.mon.get_file_type(Path(self.folder, file), data)
                 if not (Path(file).suffix[1:].lower() == format or (format=='jpeg' and Path(file).suffix[1:].lower() == 'jpg')):
                     self.log.warning('file: {} is of type {}, the extension is wrong! please fix this'.format(file, format))
@@ -145,24 +277,40 @@ class PIL_methods:
         return files_images
         
     def fix_file_type(self, filename, file_type, image_data=None):
+        '''
+        get file type from probe data (image_data), probing the file if image_data is not given
+        '''
         if not all([HAVE_PIL, file_type]):
             return file_type
         org = file_type
-        file_type = Image.open(filename).format.lower() if not image_data else image_data.format.lower()
+        file_type = (image_data or self.mon.probe.probe(filename))['format']
         if file_type in['jpg', 'jpeg', 'mpo']:
             file_type = 'jpeg'
         if not (org == file_type or (org == 'jpg' and file_type == 'jpeg')):
             self.log.warning('file {} type changed from {} to {}'.format(filename, org, file_type))
         return file_type
         
+    def needs_transcode(self, filename, file_type, image_data=None):
+        '''
+        check probe data (image_data) to see if file should be transcoded before uploading
+        probes the file if image_data is not given
+        '''
+        if not all([HAVE_PIL, file_type, self.mon.transcoder]):
+            return False
+        return self.mon.transcoder.needed(file_type, (image_data or self.mon.probe.probe(filename))['size'])
+        
     def are_images_equal(self, img1, img2):
         '''
         rough check if images are similar using PIL (avoid numpy which is faster)
         '''
-        img1 = img1.convert('L').resize((384, 216)).filter(ImageFilter.GaussianBlur(radius=2))
-        img2 = img2.convert('L').resize((384, 216)).filter(ImageFilter.GaussianBlur(radius=2))
+        return self.are_frames_equal(get_frame(img1), get_frame(img2))
+        
+    def are_frames_equal(self, img1, img2):
+        '''
+        compare two frames made by get_frame
+        '''
         img3 = ImageChops.difference(img1, img2)    #updated 11/3/25 per suggestion in issue #11
-        diff = sum(list(img3.getdata()))/(384*216)  #normalize
+        diff = ImageStat.Stat(img3).sum[0]/(FRAME_SIZE[0]*FRAME_SIZE[1])  #normalize
         equal_content = diff <= 1.0                 #pick a threshhold
         self.log.debug('equal_content: {}, diff: {}'.format(equal_content, diff))
         return equal_content
@@ -170,8 +318,10 @@ class PIL_methods:
 class monitor_and_display:
     
     allowed_ext = ['jpg', 'jpeg', 'png', 'bmp', 'tif']
+    #events pushed by the TV that update the tv state
+    tv_events = ['art_mode_changed', 'artmode_status', 'image_selected', 'go_to_standby', 'wakeup']
     
-    def __init__(self, ip, folder, period=5, update_time=1440, display_for=120, include_fav=False, sync=True, matte='none', sequential=False, on=False, token_file=None, art_mode=False):
+    def __init__(self, ip, folder, period=5, update_time=1440, display_for=120, include_fav=False, sync=True, matte='none', sequential=False, on=False, token_file=None, art_mode=False, compare='hash', workers=None, worker_queue=32, reconcile=60, upload_limit=1, transcode=False, resolution=(3840, 2160), cache_size=0, prefetch=2, order='name', listing_ttl=300, sync_budget=0.5, probe_limit=100):
         self.log = logging.getLogger('Main.'+__class__.__name__)
         self.debug = self.log.getEffectiveLevel() <= logging.DEBUG
         self.ip = ip
@@ -181,14 +331,33 @@ class monitor_and_display:
         self.display_for = display_for
         self.include_fav = include_fav
         self.sync = sync
+        self.sync_budget = sync_budget  #fraction of time spent syncronizing files with the tv at startup
+        self.compare = compare
         self.matte = matte
         self.sequential = sequential
+        self.order = order              #sequential slideshow order, 'name' or 'date'
         self.on = on
         # Autosave token to file
         self.token_file = Path(token_file) if token_file else token_file
         self.art_mode = art_mode
         self.art_task = None
+        self.reconcile = reconcile
+        self.upload_limit = upload_limit
+        self.cache_size = cache_size    #max number of files kept on the tv, 0 to upload all files
+        self.prefetch = prefetch        #number of upcoming slideshow files uploaded in advance (cache mode)
+        self.slideshow_files = []       #files available for the slideshow (cache mode)
+        self.upcoming = []              #next files in the slideshow (cache mode)
+        self.prefetch_task = None
+        self.deck = SlideshowDeck(sequential=self.sequential, key=self.get_sort_key)
+        #cached My Photos and Favourites lists
+        self.listings = {category: ContentListing(category, self.fetch_tv_content, listing_ttl) for category in ['MY-C0002', 'MY-C0004']}
+        self.cache_lock = asyncio.Lock()
+        self.state_task = None
+        self.tv_state = {'art_mode': None, 'power': None, 'content_id': None}
+        self.state_event = asyncio.Event()
+        self.last_event = 0
         self.program_data_path = Path('./uploaded_files.json')
+        self.state = StateStore(self.program_data_path)
         self.uploaded_files = {}
         self.fav = set()
         self.api_version = 0
@@ -199,9 +368,17 @@ class monitor_and_display:
         self.updated = True
         self.exit = False
         self.busy = False
-        self.lock = asyncio.Lock()
+        #commands sent to the tv, bulk commands use at most upload_limit slots, so there is always one free for other commands
+        self.scheduler = TVScheduler(slots=self.upload_limit+1, reserved=1)
         self.timers = {}
         self.modified_files = set()
+        self.folder_files = None
+        self.file_hashes = {}
+        self.watcher = FolderWatcher(self.folder)
+        self.pool = WorkerPool(workers, max_pending=worker_queue)
+        #probe_limit is the max number of full probe results (exif and comparison frame) held in memory
+        self.probe = ImageProbe(pool=self.pool, store=FileCache('probe') if HAVE_PIL else None, max_full=probe_limit)
+        self.transcoder = Transcoder(size=resolution, pool=self.pool) if transcode and HAVE_PIL else None
         self.pil = PIL_methods(self)
         self.tv = SamsungTVAsyncArt(host=self.ip, port=8002, token_file=self.token_file)
         try:
@@ -216,23 +393,28 @@ class monitor_and_display:
         program entry point
         '''
         self.busy = True
-        if self.on and not await self.tv.on():
-            self.log.info('TV is off, exiting')
-        else:
-            self.log.info('Start Monitoring')
-            try:
-                await self.tv.start_listening()
-                if self.art_mode:
-                    self.art_task = asyncio.create_task(self.ensure_artmode())
-                self.log.info('Started')
-            except Exception as e:
-                self.log.error('failed to connect with TV: {}'.format(e))
-            if self.tv.is_alive():
-                await self.check_matte()
-                await self.select_artwork()
-        await self.tv.close()
-        self.log.info('exited')
-        self.busy = False
+        try:
+            if self.on and not await self.tv.on():
+                self.log.info('TV is off, exiting')
+            else:
+                self.log.info('Start Monitoring')
+                try:
+                    self.add_tv_callbacks()
+                    await self.tv.start_listening()
+                    self.state_task = asyncio.create_task(self.track_tv_state())
+                    if self.art_mode:
+                        self.art_task = asyncio.create_task(self.ensure_artmode())
+                    self.log.info('Started')
+                except Exception as e:
+                    self.log.error('failed to connect with TV: {}'.format(e))
+                if self.tv.is_alive():
+                    await self.check_matte()
+                    await self.select_artwork()
+        finally:
+            #always close the tv and clear busy, or shutdown_trigger waits forever
+            await self.tv.close()
+            self.log.info('exited')
+            self.busy = False
         
     def close(self):
         '''
@@ -242,6 +424,15 @@ class monitor_and_display:
         self.exit = True
         if self.art_task:
             self.art_task.cancel()
+        if self.state_task:
+            self.state_task.cancel()
+        if self.prefetch_task:
+            self.prefetch_task.cancel()
+        if self.pil.task:
+            self.pil.task.cancel()
+        self.watcher.stop()
+        self.pool.close()
+        self.set_tv_state()     #wake up anything waiting for state changes
         #raise SystemExit('cancelled')
         
     async def wait_seconds(self, duration=1):
@@ -286,7 +477,7 @@ class monitor_and_display:
         '''
         initializes program
         gets API version, and current displayed art content_id
-        uses PIL if available to try to match files in folder with content_id on tv.
+        uses PIL if available to try to match files in folder with content_id on tv (in the background).
         this matching is not really needed if uploaded_files (loaded from file) is accurate,
         and can be skipped by setting sync (-s) to False
         '''
@@ -294,19 +485,25 @@ class monitor_and_display:
         self.current_content_id = await self.get_current_artwork()
         self.log.info('Current artwork is: {}'.format(self.current_content_id))
         self.load_program_data()
-        self.log.info('files in directory: {}: {}'.format(self.folder, self.get_folder_files()))
+        self.log.info('files in directory: {}: {}'.format(self.folder, await self.get_folder_files()))
         if self.sync:
-            await self.pil.initialize() #optional
+            await self.pil.initialize() #optional, runs in the background
         else:
             self.log.warning('syncing disabled, not updating uploaded files list')
         
-    async def get_tv_content(self, category='MY-C0002'):
+    async def get_tv_content(self, category='MY-C0002', refresh=False):
+        '''
+        gets content_id list of category - either My Photos (MY-C0002) or Favourites (MY-C0004)
+        the list is cached, and refreshed from the tv in the background when it is old (or now if refresh is True)
         '''
-        gets content_id list of category - either My Photos (MY-C0002) or Favourites (MY-C0004) from tv
+        return await self.listings[category].get(refresh)
+        
+    async def fetch_tv_content(self, category):
+        '''
+        gets content_id list of category from tv
         '''
         try:
-            async with self.lock:
-                result = [v['content_id'] for v in await self.tv.available(category, timeout=10)]
+            result = [v['content_id'] for v in await self.scheduler.run(POLL, self.tv.available, category, timeout=10, key=('available', category))]
         except AssertionError:
             self.log.warning('failed to get contents from TV')
             result = None
@@ -320,26 +517,36 @@ class monitor_and_display:
         '''
         thumbnails = {}
         if content_ids:
-            async with self.lock:
-                if self.api_version == 0:
-                    thumbnails = {content_id:await self.tv.get_thumbnail(content_id) for content_id in content_ids}
-                elif self.api_version == 1:
-                    thumbnails = {k.split('.')[0]:v for k,v in (await self.tv.get_thumbnail_list(content_ids)).items()}
+            if self.api_version == 0:
+                thumbnails = {content_id:await self.scheduler.run(BULK, self.tv.get_thumbnail, content_id) for content_id in content_ids}
+            elif self.api_version == 1:
+                thumbnails = {k.split('.')[0]:v for k,v in (await self.scheduler.run(BULK, self.tv.get_thumbnail_list, content_ids)).items()}
         self.log.info('got {} thumbnails'.format(len(thumbnails)))
         return thumbnails
         
-    def get_folder_files(self):
+    def list_folder(self):
+        '''
+        returns list of paths of files in folder with allowed extensions
+        '''
+        return [f for f in self.folder.iterdir() if f.is_file() and f.suffix[1:].lower() in self.allowed_ext]
+        
+    async def get_folder_files(self):
         '''
         returns list of files in folder is extension matches allowed image types
+        files are probed in the worker pool (unless already probed) to check the type
         '''
-        return [f.name for f in self.folder.iterdir() if Path(self.folder, f).is_file() and self.get_file_type(Path(self.folder, f)) in self.allowed_ext]
+        candidates = await self.pool.run_io(self.list_folder)
+        probes = await self.probe.aprobe_all(candidates)
+        files = [f for f in candidates if f in probes and self.get_file_type(f, probes[f]) in self.allowed_ext]
+        self.probe.forget(files)
+        return [f.name for f in files]
         
     async def get_current_artwork(self):
         '''
         reads currently displayed art content_id from tv
         '''
         try:
-            content_id = (await self.tv.get_current()).get('content_id')
+            content_id = (await self.scheduler.run(POLL, self.tv.get_current, key='get_current')).get('content_id')
         except Exception:
             content_id = None
         return content_id
@@ -363,30 +570,25 @@ class monitor_and_display:
         '''
         load previous settings on program start update
         '''
-        if self.program_data_path.is_file():
-            program_data = json.loads(self.program_data_path.read_text())
-            self.uploaded_files = program_data.get('uploaded_files', program_data)
-            self.start = program_data.get('last_update', time.time())
-        else:
-            self.uploaded_files = {}
-            self.start = time.time()
+        self.uploaded_files, start = self.state.load()
+        self.start = start or time.time()
         
     def write_program_data(self):
         '''
         save current settings, including file list with content_id on tv and last updated time
         also save the last time that art was updated, for timing slideshows
+        only the changes are saved (to a journal), so this is cheap to call
         '''
-        
-        program_data = {'last_update': self.start, 'uploaded_files': self.uploaded_files}
-        self.program_data_path.write_text(json.dumps(program_data, indent=2))
+        self.state.save(self.uploaded_files, self.start)
             
-    def read_file(self, filename):
+    def read_file(self, filename, image_data=None):
         '''
         read image file, return file binary data and file type
+        image_data is the probe result for the file, so it isn't probed again (this is called from a worker thread)
         '''
         try:
             file_data = Path(filename).read_bytes()
-            file_type = self.get_file_type(filename)
+            file_type = self.get_file_type(filename, image_data)
             return file_data, file_type
         except Exception as e:
             self.log.error('Error reading file: {}, {}'.format(filename, e))
@@ -408,41 +610,94 @@ class monitor_and_display:
             self.log.error('Error reading file: {}, {}'.format(filename, e))
         return None
             
+    def needs_transcode(self, filename, image_data=None):
+        '''
+        return True if file should be converted before uploading (transcoding enabled, and file is too big or not a jpeg)
+        '''
+        return self.pil.needs_transcode(filename, self.get_file_type(filename, image_data), image_data)
+            
     def update_uploaded_files(self, filename, content_id):
         '''
         if file is uploaded, update the dictionary entry
         if content_id is None, file failed to upload, so remove it from the dict
+        if the file has been deleted (eg while it was uploading), it is still added, so the next scan deletes the content from the tv
         '''
         self.uploaded_files.pop(filename, None)
         if content_id:
-            self.uploaded_files[filename] = {'content_id': content_id, 'modified':self.get_last_updated(filename)}
+            try:
+                modified = self.get_last_updated(filename)
+            except OSError:
+                self.log.warning('file: {} has been removed, its content will be deleted from the tv on the next scan'.format(filename))
+                modified = None
+            self.uploaded_files[filename] = {'content_id': content_id, 'modified':modified, 'hash': self.file_hashes.pop(filename, None)}
         
     async def upload_files(self, filenames):
         '''
         upload files in list to tv
+        files are read in the background while the previous file is uploading, failed uploads are retried
+        program data is written once, when all files are done
         '''
-        for filename in filenames:
-            path = Path(self.folder, filename)
-            file_data, file_type = self.read_file(path)
-            if file_data and self.tv.art_mode:
-                self.log.info('uploading : {} to tv'.format(filename))
-                async with self.lock:
-                    self.update_uploaded_files(filename, await self.tv.upload(file_data, file_type=file_type, matte=self.matte, portrait_matte=self.matte, timeout=20))
-                if self.uploaded_files.get(filename, {}).get('content_id'):
-                    self.log.info('uploaded : {} to tv as {}'.format(filename, self.uploaded_files[filename]['content_id']))
-                else:
-                    self.log.warning('file: {} failed to upload'.format(filename))
-                self.write_program_data()
+        pipeline = UploadPipeline(self.prepare_upload, self.upload_file, in_flight=self.upload_limit, prefetch=self.upload_limit+1)
+        results = await pipeline.run(filenames, on_result=self.uploaded)
+        if results:
+            self.write_program_data()
+            
+    async def prepare_upload(self, filename):
+        '''
+        wait for file to finish arriving, then read it (transcoding it first if needed)
+        returns (file data, file type), or None to skip the file
+        '''
+        if self.exit or not self.tv.art_mode:
+            return None
+        path = Path(self.folder, filename)
+        if not self.watcher.running:    #watcher only reports files that have been closed
+            await self.wait_for_file(path)
+        image_data = await self.probe.aprobe(path)      #probed here, as the probe memo is not thread safe
+        if self.transcoder and self.needs_transcode(path, image_data):
+            if jpeg := await self.transcoder.get(path):
+                return await self.pool.run_io(jpeg.read_bytes), 'jpeg'
+        file_data, file_type = await self.pool.run_io(self.read_file, path, image_data)
+        return (file_data, file_type) if file_data else None
+        
+    async def upload_file(self, filename, data):
+        '''
+        upload one file to tv, returns content_id or None if the upload failed
+        uploads are bulk commands, so other commands don't have to wait for a batch of uploads to finish
+        '''
+        file_data, file_type = data
+        self.log.info('uploading : {} to tv'.format(filename))
+        content_id = await self.scheduler.run(BULK, self.tv.upload, file_data, file_type=file_type, matte=self.matte, portrait_matte=self.matte, timeout=20)
+        if content_id:
+            self.listings['MY-C0002'].add([content_id])
+        return content_id
+            
+    def uploaded(self, filename, content_id):
+        '''
+        called by the upload pipeline as each file is done
+        '''
+        self.update_uploaded_files(filename, content_id)
+        if content_id:
+            self.log.info('uploaded : {} to tv as {}'.format(filename, content_id))
+        else:
+            self.log.warning('file: {} failed to upload'.format(filename))
             
     async def delete_files_from_tv(self, content_ids):
         '''
         remove files from tv if tv is in art mode
+        returns True if the files were deleted
         '''
-        if self.tv.art_mode:
-            async with self.lock:
-                self.log.info('removing files from tv : {}'.format(content_ids))
-                await self.tv.delete_list(content_ids)
-            await self.sync_file_list()
+        if not self.tv.art_mode:
+            return False
+        self.log.info('removing files from tv : {}'.format(content_ids))
+        try:
+            await self.scheduler.run(BULK, self.tv.delete_list, content_ids)
+        except Exception as e:
+            self.log.warning('failed to remove files from tv : {}, {}'.format(content_ids, e))
+            return False
+        for listing in self.listings.values():
+            listing.remove(content_ids)
+        await self.sync_file_list()
+        return True
 
     def get_last_updated(self, filename):
         '''
@@ -450,51 +705,246 @@ class monitor_and_display:
         '''
         return Path(self.folder, filename).stat().st_mtime
         
+    async def get_hashes(self, files):
+        '''
+        calculate content hash of files in the worker pool, returns dictionary of filename: hash
+        the hashes are also kept in self.file_hashes, to be saved with the content_id when the file is uploaded
+        '''
+        hashes = await self.pool.map(lambda f: self.pool.run_io(get_content_hash, Path(self.folder, f)), files)
+        self.file_hashes.update(hashes)
+        return hashes
+        
+    async def hash_uploaded_files(self, files):
+        '''
+        add content hash to uploaded files that don't have one (ie were uploaded by an older version)
+        only files that have not been modified since they were uploaded are hashed
+        '''
+        missing = [f for f in files if f in self.uploaded_files and not self.uploaded_files[f].get('hash') and Path(self.folder, f).is_file()
+                   and self.uploaded_files[f].get('modified') == self.get_last_updated(f)]
+        if missing:
+            self.log.info('calculating content hash of {} uploaded files'.format(len(missing)))
+            for f, h in (await self.get_hashes(missing)).items():
+                self.uploaded_files[f]['hash'] = h
+                self.file_hashes.pop(f, None)
+            self.write_program_data()
+            
+    def get_referenced_content_ids(self, exclude=()):
+        '''
+        return set of content_ids used by uploaded files, except files in exclude
+        '''
+        return {v['content_id'] for k, v in self.uploaded_files.items() if k not in exclude}
+        
     async def remove_files(self, files):
         '''
         if files deleted, remove them from tv
-        '''
-        content_ids_removed = [v['content_id'] for k, v in self.uploaded_files.items() if k not in files]
-        #delete images from tv
-        if content_ids_removed:
-            await self.delete_files_from_tv(content_ids_removed)
+        content on the tv is only deleted if no other file (eg a renamed file, or a duplicate) uses it
+        the files are kept in uploaded_files until their content is deleted, so a failed delete is tried again on the next scan
+        '''
+        removed = [k for k in self.uploaded_files.keys() if k not in files]
+        if removed:
+            content_ids_removed = list({self.uploaded_files[k]['content_id'] for k in removed} - self.get_referenced_content_ids(removed))
+            #delete images from tv
+            if content_ids_removed and not await self.delete_files_from_tv(content_ids_removed):
+                return False
+            for k in removed:
+                self.uploaded_files.pop(k, None)
+            self.write_program_data()
             return True
         return False
+        
+    def get_hashed_content_ids(self):
+        '''
+        return dictionary of content hash: content_id for uploaded files that have a hash
+        '''
+        return {v['hash']: v['content_id'] for v in self.uploaded_files.values() if v.get('hash')}
+        
+    async def upload_new_files(self, files, hashes=None):
+        '''
+        upload files to tv
+        files with the same content as a file already on the tv (renamed, or duplicate files) use the same content_id
+        and byte identical files in files are only uploaded once
+        hashes is the dictionary of filename: hash from get_hashes(files), if already calculated
+        '''
+        hashes = await self.get_hashes(files) if hashes is None else hashes
+        content_ids = self.get_hashed_content_ids()
+        uploads = {}
+        for f in files:
+            if hashes.get(f) in content_ids:
+                self.log.info('file: {} is already on tv as {}, not uploading'.format(f, content_ids[hashes[f]]))
+                self.update_uploaded_files(f, content_ids[hashes[f]])
+            else:
+                uploads.setdefault(hashes.get(f, f), []).append(f)
+        await self.upload_files([same[0] for same in uploads.values()])
+        for first, *duplicates in uploads.values():
+            content_id = self.uploaded_files.get(first, {}).get('content_id')
+            for f in duplicates:
+                self.log.info('file: {} is the same as {}, not uploading'.format(f, first))
+                self.update_uploaded_files(f, content_id)
+        self.write_program_data()
             
     async def add_files(self, files):
         '''
         if new files found, upload to tv
         '''
-        new_files = [f for f in files if f not in self.uploaded_files.keys()]
+        if self.cache_size:
+            return self.update_cache_files(files)
+        new_files = [f for f in files if f not in self.uploaded_files.keys() and not self.watcher.is_settling(f) and f not in self.pil.pending]
         self.modified_files.update(new_files)
         #upload new files
         if new_files:
             self.log.info('adding files to tv : {}'.format(new_files))
-            await self.wait_for_files(new_files)
-            await self.upload_files(new_files)
+            await self.upload_new_files(new_files)
             return True
         return False
             
-    async def update_files(self, files):
-        '''
-        check if files were modified
-        if so, delete old content on tv and upload new
-        '''
-        modified_files = [f for f in files if f in self.uploaded_files.keys() and self.uploaded_files[f].get('modified') != self.get_last_updated(f)]
-        self.modified_files.update(modified_files)
+    async def update_files(self, files, changed=None):
+        '''
+        check if files were modified (only files in changed, if given)
+        if the content has changed, delete old content on tv (if no other file uses it) and upload new
+        if only the timestamp has changed, just update the timestamp
+        '''
+        candidates = files if changed is None else [f for f in files if f in changed and not self.watcher.is_settling(f)]
+        candidates = [f for f in candidates if Path(self.folder, f).is_file()]     #files removed since the scan are handled by remove_files next time
+        modified_files = [f for f in candidates if f in self.uploaded_files.keys() and self.uploaded_files[f].get('modified') != self.get_last_updated(f)]
+        if not modified_files:
+            return False
+        hashes = await self.get_hashes(modified_files)
+        touched = [f for f in modified_files if hashes.get(f) and hashes[f] == self.uploaded_files[f].get('hash')]
+        if touched:
+            self.log.info('files touched, but not changed : {}'.format(touched))
+            for f in touched:
+                self.uploaded_files[f]['modified'] = self.get_last_updated(f)
+                self.file_hashes.pop(f, None)
+            self.write_program_data()
+        modified_files = [f for f in modified_files if f not in touched]
         #delete old file and upload new:
         if modified_files:
             self.log.info('updating files on tv : {}'.format(modified_files))
-            await self.wait_for_files(modified_files)
-            files_to_delete = [v['content_id'] for k, v in self.uploaded_files.items() if k in modified_files]
-            await self.delete_files_from_tv(files_to_delete)
-            await self.upload_files(modified_files)
-            return True
-        return False
+            files_to_delete = list({self.uploaded_files[k]['content_id'] for k in modified_files} - self.get_referenced_content_ids(modified_files))
+            #the old entries are kept until the old content is deleted, and the files are checked again on the next scan
+            if files_to_delete and not await self.delete_files_from_tv(files_to_delete):
+                self.watcher.restore(modified_files)
+                return bool(touched)
+            self.modified_files.update(modified_files)
+            for k in modified_files:
+                self.uploaded_files.pop(k, None)
+            self.write_program_data()
+            if not self.cache_size:     #in cache mode, files are uploaded when they are needed
+                await self.upload_new_files(modified_files)
+        return True
+            
+    def update_cache_files(self, files):
+        '''
+        cache mode: new files are not uploaded, they are added to the slideshow, and uploaded when they are needed
+        returns True if files were added or removed
+        '''
+        current = set(files)
+        new_files = [f for f in files if f not in self.slideshow_files and not self.watcher.is_settling(f)]
+        count = len(self.slideshow_files)
+        self.slideshow_files = [f for f in self.slideshow_files if f in current] + new_files
+        self.upcoming = [f for f in self.upcoming if f in current or f in self.fav]
+        self.modified_files.update(new_files)
+        if new_files:
+            self.log.info('adding files to slideshow : {}'.format(new_files))
+        return bool(new_files) or len(self.slideshow_files) != count + len(new_files)
+        
+    def get_filename(self, content_id):
+        '''
+        return filename for content_id, or None
+        '''
+        return next((k for k, v in self.uploaded_files.items() if v['content_id'] == content_id), None)
+        
+    def fill_upcoming(self):
+        '''
+        cache mode: take the next prefetch files for the slideshow from the deck
+        '''
+        while len(self.upcoming) < max(1, self.prefetch):
+            item = self.deck.next()
+            if item is None or item in self.upcoming:
+                break
+            self.upcoming.append(item)
+            
+    async def get_next_cached_art(self):
+        '''
+        cache mode: get next content_id for the slideshow, uploading the file if it is not on the tv
+        then start uploading the following files in the background
+        '''
+        self.fill_upcoming()
+        if not self.upcoming:
+            return None
+        content_id = await self.make_resident(self.upcoming.pop(0))
+        self.fill_upcoming()
+        if not (self.prefetch_task and not self.prefetch_task.done()):
+            self.prefetch_task = asyncio.create_task(self.prefetch_files())
+        return content_id
+        
+    async def prefetch_files(self):
+        '''
+        cache mode: upload the next files in the slideshow in advance
+        '''
+        try:
+            for filename in self.upcoming[:self.prefetch]:
+                if self.exit:
+                    break
+                await self.make_resident(filename)
+        except Exception as e:
+            self.log.warning('error prefetching files: {}'.format(e))
             
-    async def wait_for_files(self, files):
-        #wait for files to arrive
-        await self.wait_seconds(min(10, 5 * len(files)))
+    async def make_resident(self, filename):
+        '''
+        cache mode: make sure file is on the tv, uploading it (and evicting old files to make room) if needed
+        returns content_id or None if it could not be uploaded
+        '''
+        if filename in self.fav:
+            return filename
+        async with self.cache_lock:
+            if filename not in self.uploaded_files:
+                hashes = await self.get_hashes([filename])
+                if hashes.get(filename) not in self.get_hashed_content_ids():     #a duplicate doesn't need room on the tv
+                    await self.evict_files(1)
+                    self.log.info('uploading : {} on demand'.format(filename))
+                await self.upload_new_files([filename], hashes)
+        return self.uploaded_files.get(filename, {}).get('content_id')
+        
+    def mark_shown(self, content_id):
+        '''
+        cache mode: save the time content_id was shown, used to find the least recently shown files
+        '''
+        for v in self.uploaded_files.values():
+            if v['content_id'] == content_id:
+                v['shown'] = time.time()
+        self.write_program_data()
+        
+    async def evict_files(self, count=1):
+        '''
+        cache mode: delete least recently shown files from tv so there is room for count more files
+        the current and upcoming files are never evicted, and files are only removed from uploaded_files once they are deleted
+        '''
+        shown = {}
+        for v in self.uploaded_files.values():
+            shown[v['content_id']] = max(shown.get(v['content_id'], 0), v.get('shown', 0))
+        excess = len(shown) + count - self.cache_size
+        if excess <= 0:
+            return
+        keep = {self.current_content_id}.union(v['content_id'] for k, v in self.uploaded_files.items() if k in self.upcoming)
+        victims = sorted([c for c in shown.keys() if c not in keep], key=lambda c: shown[c])[:excess]
+        if victims:
+            self.log.info('tv cache full ({} files), removing least recently shown: {}'.format(self.cache_size, victims))
+            if await self.delete_files_from_tv(victims):
+                self.uploaded_files = {k: v for k, v in self.uploaded_files.items() if v['content_id'] not in victims}
+                self.write_program_data()
+            
+    async def wait_for_file(self, path, settle=2, timeout=10):
+        '''
+        wait for file to arrive, ie it has not been modified for settle seconds (up to timeout seconds)
+        files that are already there are not delayed
+        '''
+        end = time.time() + timeout
+        while not self.exit and time.time() < end:
+            mtime = (await self.pool.run_io(get_stat_key, path))[0] / 1e9
+            if time.time() - mtime >= settle:
+                break
+            await asyncio.sleep(1)
         
     def get_modified_files(self):
         '''
@@ -510,7 +960,7 @@ class monitor_and_display:
         changes art on tv as part of slideshow if enabled
         updates favourites list if favourites are included in slideshow
         '''
-        if self.update_time > 0 and (len(self.uploaded_files.keys()) > 1 or self.include_fav):
+        if self.update_time > 0 and (len(self.deck) > 1 or self.include_fav):
             if time.time() - self.start >= self.update_time:
                 self.log.info('doing slideshow update, after {}'.format(self.get_time(self.update_time)))
                 self.start = time.time()
@@ -519,6 +969,7 @@ class monitor_and_display:
                     self.log.info('updating favourites')
                     fav = await self.get_tv_content('MY-C0004')
                     self.fav = set(fav) if fav is not None else self.fav
+                    self.update_deck()
                 await self.change_art()
             else:
                 self.log.info('next {} update in {}'.format('sequential' if self.sequential else 'random', self.get_time(self.update_time - (time.time() - self.start))))
@@ -529,41 +980,57 @@ class monitor_and_display:
         '''
         return list({v['content_id'] for v in self.uploaded_files.values()}.union(self.fav))
         
-    def get_next_art(self):
+    def get_sort_key(self, item):
         '''
-        get next content_id from list (excluding current content id), set current_content_id or return None if no list
+        return sort key for slideshow item (filename or favourite content_id), for sequential slideshows
+        sorted by name, or by file date if order is 'date' (in the same format as exif dates)
         '''
-        content_ids = [id for id in self.get_content_ids() if id != self.current_content_id]
-        if content_ids:
-            content_id = self.next_value(self.current_content_id, content_ids) if self.sequential else random.choice(content_ids)
-            return content_id
-        return None
+        if self.order == 'date':
+            try:
+                return time.strftime('%Y:%m:%d %H:%M:%S', time.localtime(self.get_last_updated(item)))
+            except OSError:
+                return ''
+        return item.lower()
+        
+    def update_deck(self):
+        '''
+        update slideshow deck with files (and favourites if included), only the changes are applied
+        '''
+        self.deck.update(list(self.slideshow_files if self.cache_size else self.uploaded_files.keys()) + (list(self.fav) if self.include_fav else []))
         
-    def next_value(self, value, lst):
+    def get_next_art(self):
         '''
-        get next value from list, or return first element
-        return None if list is empty
+        get next content_id from slideshow deck (excluding current content id), or return None if deck is empty
         '''
-        return lst[(lst.index(value)+1) % len(lst)] if value in lst else lst[0] if lst else None
+        item = self.deck.next()
+        return self.uploaded_files.get(item, {}).get('content_id', item) if item else None
         
     async def change_art(self, new_content_id=None):
         '''
         update displayed art on tv, if next_art is a different content_id to current
         '''
-        content_id = new_content_id or self.get_next_art()
+        content_id = new_content_id or (await self.get_next_cached_art() if self.cache_size else self.get_next_art())
         if content_id and content_id != self.current_content_id:
             self.log.info('selecting tv art: content_id: {}'.format(content_id))
-            await self.tv.select_image(content_id)
+            await self.scheduler.run(INTERACTIVE, self.tv.select_image, content_id)
             self.current_content_id = content_id
+            self.set_tv_state(content_id=content_id)
+            if self.cache_size:
+                self.mark_shown(content_id)
         else:
             self.log.info('skipping art update, as new content_id: {} is the same as currently shown'.format(content_id))
             
     async def set_image_from_filename(self, filename):
         '''
         set image on TV from filename, and pause auto rotation
+        in cache mode, the file is uploaded first if it is not on the tv
         '''
         try:
-            content_id = self.uploaded_files[filename]['content_id']
+            content_id = await self.make_resident(filename) if self.cache_size else self.uploaded_files[filename]['content_id']
+            if not content_id:
+                raise ValueError('file could not be uploaded')
+            self.deck.set_current(filename)     #sequential slideshow continues from here
+            self.upcoming = []
             self.skip = time.time()
             self.start = 0
             await self.change_art(content_id)
@@ -575,6 +1042,7 @@ class monitor_and_display:
         async generator that yields changed filename or 'off'
         '''
         while not self.exit:
+            event = self.state_event        #captured before the state is read, so changes while the consumer is busy aren't missed
             if self.updated:
                 self.updated = False
                 self.prev_filename = None
@@ -585,7 +1053,7 @@ class monitor_and_display:
                     self.prev_filename = filename
                     self.log.info('returning: {}'.format(filename))
                     yield filename
-            await asyncio.sleep(1)
+            await self.wait_for_tv_state(self.reconcile, event)
         yield 'off'
             
     async def get_current_filename(self, direct=False):
@@ -606,58 +1074,166 @@ class monitor_and_display:
     async def tv_in_artmode(self):
         '''
         is TV on, and in art mode
+        uses the tracked tv state, only asks the TV if the state is not known
         '''
+        if self.tv_state['art_mode'] is not None:
+            return self.tv_state['art_mode']
         try:
-            async with self.lock:
-                if not self.exit:
-                    return await self.tv.in_artmode()
+            if not self.exit:
+                self.set_tv_state(art_mode=await self.scheduler.run(POLL, self.tv.in_artmode, key='in_artmode'))
+                return self.tv_state['art_mode']
         except AssertionError as e:
             self.log.warning('AssertionError error: {} returning: {}'.format(e, self.tv.art_mode))
         return self.tv.art_mode
         
+    def add_tv_callbacks(self):
+        '''
+        register for events pushed by the TV
+        '''
+        if hasattr(self.tv, 'set_callback'):
+            for event in self.tv_events:
+                self.tv.set_callback(event, self.on_tv_event)
+        else:
+            self.log.warning('TV events not supported, polling TV state every {}'.format(self.get_time(self.reconcile)))
+            
+    def on_tv_event(self, *args):
+        '''
+        callback for events pushed by the TV, updates tv state
+        the event data is a dictionary, sometimes with the event details json encoded in 'data'
+        '''
+        data = next((a for a in reversed(args) if isinstance(a, dict)), {})
+        if isinstance(data.get('data'), str):
+            try:
+                data = json.loads(data['data'])
+            except ValueError:
+                pass
+        event = data.get('event')
+        self.log.debug('TV event: {}: {}'.format(event, data))
+        self.last_event = time.time()
+        match event:
+            case 'art_mode_changed':
+                self.set_tv_state(art_mode=data.get('status') == 'on', power=True)
+            case 'artmode_status':
+                self.set_tv_state(art_mode=data.get('value') == 'on', power=True)
+            case 'image_selected':
+                if data.get('content_id'):
+                    self.set_tv_state(content_id=data['content_id'], power=True)
+            case 'go_to_standby':
+                self.set_tv_state(art_mode=False, power=False)
+            case 'wakeup':
+                self.set_tv_state(art_mode=None, power=True)    #art mode is unknown until next event or reconcile
+                
+    def set_tv_state(self, **kwargs):
+        '''
+        update tv state, and wake up anything waiting for a change
+        '''
+        changed = {k:v for k, v in kwargs.items() if self.tv_state.get(k) != v}
+        if changed or not kwargs:
+            self.log.info('TV state changed: {}'.format(changed) if changed else 'TV state notify')
+            self.tv_state.update(changed)
+            if 'content_id' in changed:
+                self.current_content_id = changed['content_id']
+            #replace event, so every waiter gets woken
+            self.state_event.set()
+            self.state_event = asyncio.Event()
+            
+    async def wait_for_tv_state(self, timeout, event=None):
+        '''
+        wait until tv state changes, or timeout (seconds)
+        pass the state event captured before the state was read, to return straight away if it has changed since
+        '''
+        try:
+            await asyncio.wait_for((event or self.state_event).wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        
+    async def track_tv_state(self):
+        '''
+        slow reconciliation poll of tv state, in case events are missed
+        polls more often if the state is not known
+        '''
+        while not self.exit:
+            try:
+                power = await self.scheduler.run(POLL, self.tv.on, key='on')
+                art_mode = await self.scheduler.run(POLL, self.tv.in_artmode, key='in_artmode') if power else False
+                self.set_tv_state(power=power, art_mode=art_mode)
+                if art_mode:
+                    content_id = await self.get_current_artwork()
+                    if content_id:
+                        self.set_tv_state(content_id=content_id)
+            except AssertionError as e:
+                self.log.warning('AssertionError reconciling tv state')
+            except Exception as e:
+                self.log.warning('error reconciling tv state: {}'.format(e))
+            await self.wait_seconds(self.reconcile if self.tv_state['art_mode'] is not None else 5)
+            
     async def ensure_artmode(self):
         '''
         Keep TV in art_mode, (ie not playing) unless TV is off
+        reacts to tv state changes, which are updated by events pushed by the TV or the reconciliation poll
         '''
         self.log.info('ensure art_mode enabled')
         self.tv_remote = SamsungTVWSAsyncRemote(host=self.ip, port=8002, token_file=self.token_file)
         while not self.exit:
+            event = self.state_event
             try:
-                async with self.lock:
-                    if await self.tv.on():
-                        if await self.tv.get_artmode() != 'on':
-                            #send KEY_POWER
-                            self.log.warning('TV is playing, sending KEY_POWER')
-                            await self.tv_remote.send_command(SendRemoteKey.click("KEY_POWER"))
+                if self.tv_state['power'] and self.tv_state['art_mode'] is False:
+                    if await self.scheduler.run(POLL, self.tv.get_artmode, key='get_artmode') != 'on':
+                        #send KEY_POWER
+                        self.log.warning('TV is playing, sending KEY_POWER')
+                        await self.tv_remote.send_command(SendRemoteKey.click("KEY_POWER"))
             except AssertionError as e:
                 self.log.warning('AssertionError')
-            await self.wait_seconds(15)
+            await self.wait_for_tv_state(self.reconcile, event)
         await self.tv_remote.close()
     
+    async def files_changed(self, files):
+        '''
+        called by check_dir when files have been added, removed or modified
+        override this to update anything that depends on the folder contents
+        '''
+        pass
+        
     async def check_dir(self):
         '''
         scan folder for new, deleted or updated files, but only when tv is in art mode
+        if the scan fails, the changes from the folder watcher are put back, so they are checked again next time
         '''
+        changed = set()
         try:
             if await self.tv_in_artmode():
-                self.log.info('checking directory: {}{}'.format(self.folder, ' every {}'.format(self.get_time(self.period)) if self.period else ''))
-                files = self.get_folder_files()
-                await self.sync_file_list()
-                self.updated = any([
-                    await self.remove_files(files),
-                    await self.add_files(files),
-                    await self.update_files(files),
-                ])
+                #if the folder is being watched, only scan it when something has changed
+                changed = self.watcher.take()
+                if changed is None or changed or self.folder_files is None:
+                    self.log.info('checking directory: {}{}'.format(self.folder, ' every {}'.format(self.get_time(self.period)) if self.period and not self.watcher.running else ''))
+                    self.folder_files = await self.get_folder_files()
+                files = self.folder_files
+                #cache mode uploads and evicts files in the background, so uploaded_files can't change while it is being updated here
+                async with self.cache_lock:
+                    await self.sync_file_list()
+                    await self.hash_uploaded_files(files)
+                    #add before remove, so renamed files keep their content on the tv
+                    self.updated = any([
+                        await self.add_files(files),
+                        await self.update_files(files, changed),
+                        await self.remove_files(files),
+                    ])
+                if self.updated:
+                    await self.files_changed(files)
+                    self.set_tv_state()     #notify filename_changed to send refresh
+                self.update_deck()          #after files_changed, so anything the sort key needs (eg exif) is loaded
+                changed = set()             #scan done, nothing to put back if changing the art fails
                 #update tv art if enabled by timer or skip if manually selected
                 if time.time() - self.skip <= self.display_for:
                     return
                 await self.update_art_timer()
-                if len(self.get_content_ids()) == 1:
+                if len(self.slideshow_files if self.cache_size else self.get_content_ids()) == 1:
                     await self.change_art()
             else:
                 self.log.info('artmode or tv is off')
         except Exception as e:
             self.log.warning("error in check_dir: {}".format(e))
+            self.watcher.restore(changed)
 
     async def select_artwork(self):
         '''
@@ -665,11 +1241,23 @@ class monitor_and_display:
         initialize, check directory for changed files and update
         '''
         await self.initialize()
+        if self.period:
+            self.watcher.start()
         while not self.exit:
             await self.check_dir()
             if self.period == 0:
                 break
-            await self.wait_seconds(self.period)
+            await self.wait_for_changes(self.period)
+            
+    async def wait_for_changes(self, duration):
+        '''
+        wait for duration seconds, or until the folder watcher sees files change
+        '''
+        if self.watcher.running:
+            if await self.watcher.wait(duration):
+                self.log.info('folder changed')
+        else:
+            await self.wait_seconds(duration)
             
 async def main():
     global log
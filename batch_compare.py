@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# vectorized batch comparison of image frames, used for the initial sync of files with TV thumbnails
+# all frames are stacked into contiguous arrays, and the mean absolute difference is calculated for every
+# (file, thumbnail) pair in chunks, so memory use is bounded by the chunk size
+# needs numpy (pip install numpy)
+
+HAVE_NUMPY = False
+try:
+    import numpy as np
+    HAVE_NUMPY=True
+except ImportError:
+    pass
+import logging
+
+from image_probe import FRAME_SIZE
+
+__version__ = '1.0.0'
+
+logging.basicConfig(level=logging.INFO)
+
+class BatchCompare:
+
+    threshold = 1.0     #same threshold as PIL_methods.are_frames_equal
+
+    def __init__(self, chunk_size=64*1024*1024):
+        self.log = logging.getLogger('Main.'+__class__.__name__)
+        self.chunk_size = chunk_size    #max bytes used for differences at one time
+        self.pixels = FRAME_SIZE[0]*FRAME_SIZE[1]
+        #compare sums, not means so the result is exactly the same as diff/pixels <= threshold
+        self.max_sum = int(self.threshold * self.pixels)
+
+    def stack(self, frames):
+        '''
+        stack list of frame bytes into one (n, pixels) uint8 array
+        '''
+        return np.frombuffer(b''.join(frames), dtype=np.uint8).reshape(len(frames), self.pixels)
+
+    def difference_sums(self, files, thumbnails):
+        '''
+        generator that yields (row offset, array of summed absolute differences) of files (rows) against thumbnails (columns)
+        '''
+        block = self.chunk_size // (3 * self.pixels)   #max, min and difference arrays are all this size
+        cols = max(1, min(len(thumbnails), block))
+        rows = max(1, block // cols)
+        for r in range(0, len(files), rows):
+            a = files[r:r+rows, None, :]
+            sums = np.empty((len(a), len(thumbnails)), dtype=np.uint32)
+            for c in range(0, len(thumbnails), cols):
+                b = thumbnails[None, c:c+cols, :]
+                sums[:, c:c+cols] = (np.maximum(a, b) - np.minimum(a, b)).sum(axis=2, dtype=np.uint32)
+            yield r, sums
+
+    def match(self, file_frames, thumbnail_frames):
+        '''
+        takes dictionaries of filename: frame bytes and content_id: frame bytes
+        returns dictionary of filename: content_id for the first thumbnail that matches each file
+        '''
+        if not (HAVE_NUMPY and file_frames and thumbnail_frames):
+            return {}
+        filenames = list(file_frames.keys())
+        content_ids = list(thumbnail_frames.keys())
+        self.log.info('comparing {} files with {} thumbnails'.format(len(filenames), len(content_ids)))
+        files = self.stack([file_frames[f] for f in filenames])
+        thumbnails = self.stack([thumbnail_frames[c] for c in content_ids])
+        matches = {}
+        for r, sums in self.difference_sums(files, thumbnails):
+            equal = sums <= self.max_sum
+            for i in np.flatnonzero(equal.any(axis=1)):
+                matches[filenames[r+i]] = content_ids[int(np.argmax(equal[i]))]
+        return matches
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# publish/subscribe hub, used to fan out TV state changes from one poller to all connected websockets
+# each client has it's own bounded queue, so one slow client can't hold up the others
+
+import asyncio
+from collections import deque
+import logging
+
+__version__ = '1.1.1'
+
+logging.basicConfig(level=logging.INFO)
+
+class ClientQueue:
+    '''
+    bounded outbound message queue for one client
+    'update' messages are state, so only the latest one is kept (except 'refresh' which is an event)
+    if other messages fill the queue, the client is too far behind, and overflow is set
+    '''
+
+    def __init__(self, id=None, maxsize=20):
+        self.id = id
+        self.maxsize = maxsize
+        self.messages = deque()
+        self.update = None
+        self.event = asyncio.Event()
+        self.overflow = False
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.messages) + (1 if self.update else 0)
+
+    def put(self, message):
+        '''
+        add message to queue, replacing any pending update if message is an update
+        '''
+        if message.get('type') == 'update' and message.get('name') != 'refresh':
+            if self.update:
+                self.coalesced += 1
+            self.update = message
+        elif len(self.messages) >= self.maxsize:
+            self.dropped += 1
+            self.overflow = True
+        else:
+            self.messages.append(message)
+        self.event.set()
+
+    async def get(self):
+        '''
+        wait for next message, other messages are sent before the latest update
+        returns None if the queue has overflowed
+        '''
+        while not (self.messages or self.update or self.overflow):
+            self.event.clear()
+            await self.event.wait()
+        if self.overflow:
+            return None
+        self.sent += 1
+        if self.messages:
+            return self.messages.popleft()
+        message, self.update = self.update, None
+        return message
+
+    def stats(self):
+        return {'id': self.id, 'depth': len(self), 'sent': self.sent, 'coalesced': self.coalesced, 'dropped': self.dropped, 'overflow': self.overflow}
+
+class Hub:
+
+    def __init__(self, maxsize=20):
+        self.log = logging.getLogger('Main.'+__class__.__name__)
+        self.maxsize = maxsize
+        self.subscribers = set()
+
+    def subscribe(self, id=None):
+        '''
+        return new ClientQueue that receives all published messages
+        '''
+        queue = ClientQueue(id, self.maxsize)
+        self.subscribers.add(queue)
+        self.log.debug('{} subscribers'.format(len(self.subscribers)))
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+        self.log.debug('{} subscribers'.format(len(self.subscribers)))
+
+    def publish(self, message):
+        '''
+        put message on all subscriber queues
+        '''
+        for queue in self.subscribers:
+            queue.put(message)
+
+    def stats(self):
+        '''
+        return list of queue stats for all subscribers
+        '''
+        return [queue.stats() for queue in self.subscribers]
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# cached list of content_ids in a TV category (eg My Photos), so the main loop doesn't wait for the TV every time it needs the list
+# our own uploads and deletes update the cached list directly, and changes made by other programs are picked up by refreshing
+# the list in the background when it is older than ttl seconds
+
+import asyncio
+import time
+import logging
+
+__version__ = '1.0.0'
+
+logging.basicConfig(level=logging.INFO)
+
+class ContentListing:
+
+    def __init__(self, category, fetch, ttl=300):
+        '''
+        category: TV category (eg MY-C0002)
+        fetch: coroutine function that returns list of content_ids from the TV, or None if it fails
+        ttl: seconds before the list is refreshed (in the background)
+        '''
+        self.log = logging.getLogger('Main.'+__class__.__name__)
+        self.category = category
+        self.fetch = fetch
+        self.ttl = ttl
+        self.content_ids = None
+        self.updated = 0
+        self.version = 0        #incremented on every local change, so a refresh that overlaps a change is not used
+        self.task = None
+
+    def add(self, content_ids):
+        '''
+        add content_ids we have uploaded
+        '''
+        if self.content_ids is not None:
+            self.content_ids.update(content_ids)
+        self.version += 1
+
+    def remove(self, content_ids):
+        '''
+        remove content_ids we have deleted
+        '''
+        if self.content_ids is not None:
+            self.content_ids.difference_update(content_ids)
+        self.version += 1
+
+    def invalidate(self):
+        '''
+        refresh list next time it is used
+        '''
+        self.updated = 0
+
+    async def get(self, refresh=False):
+        '''
+        return list of content_ids, or None if the TV can't be read
+        waits for the TV if there is no list yet (or refresh is True), otherwise a stale list is returned and refreshed in the background
+        '''
+        if refresh or self.content_ids is None:
+            await self.refresh()
+        elif time.time() - self.updated >= self.ttl and not (self.task and not self.task.done()):
+            self.task = asyncio.create_task(self.refresh())
+        return list(self.content_ids) if self.content_ids is not None else None
+
+    async def refresh(self):
+        '''
+        read list from TV, if a refresh is already running, wait for that one
+        '''
+        if self.task and not self.task.done() and self.task is not asyncio.current_task():
+            await asyncio.shield(self.task)
+            return
+        version = self.version
+        content_ids = await self.fetch(self.category)
+        if content_ids is None:
+            return
+        if version != self.version and self.content_ids is not None:
+            self.log.debug('{}: list changed while refreshing, will refresh again'.format(self.category))
+            self.invalidate()
+            return
+        self.log.debug('{}: refreshed {} content_ids'.format(self.category, len(content_ids)))
+        self.content_ids = set(content_ids)
+        self.updated = time.time()
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 # exif data class, gets exif data from image, and GPS location (if GPSInfo exists)
+# exif data is cached in image_cache.db, keyed by file mtime and size, so unchanged files are not read again
 # needs PIL (pip install pillow)
-# and optionally geopy (pip install geopy) for location
+# and optionally geopy (pip install geopy) for location, or a local GeoNames places file for offline location
 
 import asyncio
 import json
@@ -10,23 +11,18 @@ from pprint import pprint, pformat
 from datetime import datetime
 HAVE_PIL = False
 try:
-    from PIL import Image
     from PIL.ExifTags import TAGS, GPSTAGS, IFD
     HAVE_PIL=True
 except ImportError:
     pass
-HAVE_GEOPY = False
-try:
-    from geopy.geocoders import Nominatim
-    from geopy.adapters import AioHTTPAdapter
-    from geopy.extra.rate_limiter import AsyncRateLimiter
-    from geopy.exc import GeocoderTimedOut
-    HAVE_GEOPY=True
-except ImportError:
-    pass
 import logging
 
-__version__ = '1.0.1'
+from image_probe import ImageProbe
+from file_cache import FileCache, get_stat_key
+from geocoder import get_geocoder, GeocodeError
+from geocode_cache import GeocodeCache
+
+__version__ = '1.0.8'
 
 logging.basicConfig(level=logging.INFO)
 
@@ -40,74 +36,154 @@ class ExifData:
     ignore = ['59932', 'MakerNote', '59933']    #proprietory tags to ignore
     additional_tags = {42038: 'ImageTitle'}     #additional tags to add
     
-    def __init__(self, folder, ip=None, parent=None):
+    def __init__(self, folder, ip=None, parent=None, geocoder='nominatim', geodata=None, geo_precision=3):
                            
         self.log = logging.getLogger('Main.'+__class__.__name__)
         self.debug = self.log.getEffectiveLevel() <= logging.DEBUG
         self.folder = folder
         self.ip = ip
+        self.geocoder = get_geocoder(geocoder, geodata, user_agent="{}-SamsungtvwsGetLocGallery".format(self.ip or ''))
         self.parent = parent
         self.exif = {}
+        self.versions = {}      #file: number of times exif data (or address) for file has changed
         TAGS.update(self.additional_tags)
         self.gps_task = None
-        self.filename = Path('./gps_data.json')
-        self.get_files()
+        self.filename = Path('./gps_data.json')     #old address cache, keyed by filename, imported into geo_cache
+        self.geo_cache = GeocodeCache(precision=geo_precision)
+        self.probe = parent.probe if parent else ImageProbe()
+        self.cache = FileCache('exif') if HAVE_PIL and self.folder else None
+        if self.cache:
+            self.probe.on_full = self.probed    #files fully probed for anything (eg the PIL sync) are added to the exif cache
+        self.load_task = asyncio.create_task(self.get_files())
         
-    def get_folder_files(self):
+    async def get_folder_files(self):
         '''
         make list from files in static folder
         '''
         if self.parent:
-            return self.parent.get_folder_files()
+            return await self.parent.get_folder_files()
         return [img.name for img in self.folder.iterdir() if not img.name.upper().endswith('.TXT')]
 
-    def get_files(self, image_names=None):
+    async def get_files(self, image_names=None):
         '''
         Update exif data for files in image_names
+        exif data is loaded from the cache if the file has not changed,
+        otherwise the file is probed in the worker pool (if there is one)
         '''
         if HAVE_PIL and self.folder:
-            if image_names is None:
-                image_names = self.get_folder_files()
-            for file in image_names:
-                self.update_exif_dict(file)
-            #run as task because of rate limiting
-            if not self.gps_task or self.gps_task.done():
-                self.gps_task = asyncio.create_task(self.update_addresses(image_names.copy()))
+            try:
+                if image_names is None:
+                    image_names = await self.get_folder_files()
+                    self.cache.prune(image_names)
+                changed = {}
+                for file in image_names:
+                    try:
+                        key = get_stat_key(Path(self.folder, file))
+                    except OSError as e:
+                        self.log.warning('{}: {}'.format(file, e))
+                        continue
+                    exif = self.cache.get(file, key)
+                    if exif is None:
+                        changed[file] = key
+                    else:
+                        self.exif[file] = exif
+                        self.set_changed(file)
+                probed = set()
+                #probed in batches, so the full probe results for the whole folder are not held at once
+                #the exif data is updated and cached by self.probed, files probed since they were checked are skipped
+                async for probes in self.probe.aprobe_batches([Path(self.folder, file) for file in changed.keys()], full=True,
+                                                              needed=lambda path: not self.cache.has(path.name, changed[path.name])):
+                    probed.update(path.name for path in probes.keys())
+                    self.cache.commit()
+                for file in changed.keys() - probed:
+                    if not self.cache.has(file, changed[file]):
+                        self.update_exif_dict(file, None)   #file can't be read
+                image_names = [file for file in image_names if file in self.exif.keys()]
+                #run as task because of rate limiting
+                if not self.gps_task or self.gps_task.done():
+                    self.gps_task = asyncio.create_task(self.update_addresses(image_names.copy()))
+            except Exception as e:
+                self.log.warning('error loading exif data: {}'.format(e))   #eg the worker pool was closed on exit
+                
+    def probed(self, path, key, data):
+        '''
+        called by the image probe when a file has been fully probed, updates and caches the exif data for the file
+        the cache is committed by whatever requested the probe
+        '''
+        path = Path(path)
+        if path.parent == Path(self.folder):
+            self.update_exif_dict(path.name, data)
+            self.cache.put(path.name, key, self.exif[path.name])
                 
     def load_gps_data(self):
         '''
-        cache GPS info
+        load cached GPS info, the first time the old cache (keyed by filename) is imported if there is no address cache
+        '''
+        if not self.geo_cache.loaded and not self.geo_cache.load():
+            self.import_gps_data()
+        for file in self.exif.keys():
+            if not self.geo_cache.has_file(file):
+                continue
+            address = self.geo_cache.get_file(file)
+            if 'GEOPY_Address' not in self.exif[file].keys() or self.exif[file]['GEOPY_Address'] != address:
+                self.exif[file]['GEOPY_Address'] = address
+                self.set_changed(file)
+                
+    def import_gps_data(self):
+        '''
+        import addresses from the old GPS info cache, using the GPS location of each file
         '''
         try:
             data = json.loads(self.filename.read_text())
-            [self.exif[file].update(data[file]) for file in self.exif.keys() if data.get(file)]
         except Exception:
-            pass
+            return
+        count = 0
+        for file, value in data.items():
+            try:
+                if file in self.exif.keys() and value.get('GEOPY_Address'):
+                    lat, lng = self.get_lat_long(file)
+                    if lat and lng:
+                        self.geo_cache.put(file, lat, lng, value['GEOPY_Address'])
+                        count += 1
+            except Exception as e:
+                self.log.warning('{}: unable to import address: {}'.format(file, e))
+        self.log.info('imported {} addresses from: {}'.format(count, self.filename))
             
     def save_gps_data(self):
         '''
-        load cached gps info
+        save cached gps info
         '''
         try:
-            data = {file:{k:v} for file in self.exif.keys() for k, v in self.exif[file].items() if k ==  'GEOPY_Address'}
-            if data:
-                self.filename.write_text(json.dumps(data, indent=2))
+            self.geo_cache.prune(self.exif.keys())
+            self.geo_cache.save()
         except Exception as e:
-            pass
+            self.log.warning('unable to save addresses: {}'.format(e))
         
-    def update_exif_dict(self, file):
+    def update_exif_dict(self, file, data):
         '''
         only available if PIL is installed (pip install Pillow)
-        get exif tags from image file and update self.exif
+        get exif tags from image file probe data and update self.exif
         so that we can extract 'DateTimeOriginal' and 'GPSInfo' and other info later
-        NOTE: have to use _getexif() getexif() is different
         '''
         if HAVE_PIL: # and file not in self.exif.keys():
             self.log.info('{}: getting exif data'.format(file))
-            img = Image.open(Path(self.folder, file))
-            self.exif[file]={self.tag_name(tag): self.conv_bytes(tag, value) for tag, value in (img._getexif() or {}).items() if self.tag_name(tag) not in self.ignore}
+            exif = (data or {}).get('exif', {})
+            self.exif[file]={self.tag_name(tag): self.conv_bytes(tag, value) for tag, value in exif.items() if self.tag_name(tag) not in self.ignore}
+            self.set_changed(file)
             self.log.debug('{}: exif tags:\r\n{}'.format(file, pformat(self.exif.get(file))))
                 
+    def set_changed(self, file):
+        '''
+        mark exif data for file as changed, so anything made from it can be updated
+        '''
+        self.versions[file] = self.versions.get(file, 0) + 1
+        
+    def get_version(self, file):
+        '''
+        return version of exif data for file, changes every time the exif data or address is updated
+        '''
+        return self.versions.get(file, 0)
+        
     def conv_bytes(self, tag, value):
         '''
         decode exif values if bytes
@@ -179,29 +255,32 @@ class ExifData:
         
     async def update_addresses(self, file_list):
         '''
-        Use Geopy's Nominatim geocoder to retrieve the address for the coordinates
-        This is free, but limited to calling once per second, with a unique user_agent name for the app
-        see https://operations.osmfoundation.org/policies/nominatim/
+        Use the geocoder (Geopy's Nominatim, or the offline geocoder) to retrieve the address for the coordinates
+        Nominatim is free, but limited to calling once per second, the offline geocoder looks up the nearest place in a local file
         '''
-        if HAVE_GEOPY:
+        if self.geocoder:
             self.load_gps_data()
-            async with Nominatim(user_agent="{}-SamsungtvwsGetLocGallery".format(self.ip or ''), timeout=20, adapter_factory=AioHTTPAdapter) as geolocator:
-                reverse  = AsyncRateLimiter(geolocator.reverse, min_delay_seconds=1.5, max_retries=1, swallow_exceptions=False)
-                for file in file_list:
-                    if 'GEOPY_Address' not in self.exif[file].keys():
-                        lat, lng = self.get_lat_long(file)
-                        if lat and lng:
-                            self.log.info('{}: getting GPS data'.format(file))
-                            try:
-                                locname = await reverse(f"{lat}, {lng}")
-                                if locname:
-                                    self.exif[file]['GEOPY_Address'] = locname.raw
-                            except (asyncio.exceptions.TimeoutError, GeocoderTimedOut) as e:
-                                self.log.warning('geocode failed on {}: {}'.format(file, e))
-                                await asyncio.sleep(5)
-                            continue
-                        self.log.info('{}: NO address found'.format(file))
-                        self.exif[file]['GEOPY_Address'] = None
+            try:
+                async with self.geocoder as geolocator:
+                    for file in file_list:
+                        if 'GEOPY_Address' not in self.exif[file].keys():
+                            lat, lng = self.get_lat_long(file)
+                            if lat and lng:
+                                self.log.info('{}: getting GPS data'.format(file))
+                                try:
+                                    locname = await self.geo_cache.lookup(file, lat, lng, geolocator.reverse)
+                                    if not locname:
+                                        self.log.info('{}: NO address found'.format(file))
+                                    self.exif[file]['GEOPY_Address'] = locname
+                                    self.set_changed(file)
+                                except GeocodeError as e:
+                                    self.log.warning('geocode failed on {}: {}'.format(file, e))
+                                continue
+                            self.log.info('{}: NO address found'.format(file))
+                            self.exif[file]['GEOPY_Address'] = None
+                            self.set_changed(file)
+            except GeocodeError as e:
+                self.log.warning('geocoder not available: {}'.format(e))     #eg the offline places file can't be read
             self.save_gps_data()
            
     def format_address(self, file, locname):
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# persistent cache of data extracted from files, stored in an sqlite table
+# entries are keyed by file name, and are only valid while the file mtime and size are unchanged
+# values are pickled, so exif types (eg IFDRational) are preserved exactly
+# all tables in the same database share one connection, so a write to one table can't be blocked by uncommitted writes to another
+
+import sqlite3
+import pickle
+import hashlib
+from pathlib import Path
+import logging
+
+__version__ = '1.0.3'
+
+logging.basicConfig(level=logging.INFO)
+
+def get_stat_key(path):
+    '''
+    return (mtime, size) of path, used to check if cached data is still valid
+    '''
+    stat = Path(path).stat()
+    return stat.st_mtime_ns, stat.st_size
+
+def get_content_hash(path, chunk_size=1024*1024):
+    '''
+    return sha256 hex digest of the content of path, read in chunks so large files are not loaded into memory
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class FileCache:
+
+    connections = {}    #database path: connection shared by all tables
+
+    def __init__(self, table, path='./image_cache.db'):
+        self.log = logging.getLogger('Main.'+__class__.__name__)
+        self.table = table
+        self.path = Path(path)
+        self.db = self.get_connection(self.path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS {} (name TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, data BLOB)'.format(self.table))
+        self.keys = {name: (mtime, size) for name, mtime, size in self.db.execute('SELECT name, mtime, size FROM {}'.format(self.table))}
+        self.log.info('{}: {} cached entries'.format(self.table, len(self.keys)))
+
+    @classmethod
+    def get_connection(cls, path):
+        '''
+        return connection to database path, opening it if it is not already open
+        '''
+        key = str(path.resolve())
+        if key not in cls.connections:
+            cls.connections[key] = sqlite3.connect(path, check_same_thread=False)
+        return cls.connections[key]
+
+    def get(self, name, key):
+        '''
+        return cached value for name if key (mtime, size) matches, or None
+        '''
+        if self.keys.get(name) != tuple(key):
+            return None
+        row = self.db.execute('SELECT data FROM {} WHERE name = ?'.format(self.table), (name,)).fetchone()
+        try:
+            return pickle.loads(row[0]) if row else None
+        except Exception as e:
+            self.log.warning('error loading cached data for: {}, {}'.format(name, e))
+        return None
+
+    def has(self, name, key):
+        '''
+        True if there is a cached value for name with key (mtime, size)
+        '''
+        return self.keys.get(name) == tuple(key)
+
+    def put(self, name, key, value):
+        '''
+        store value for name with key (mtime, size), call commit() to save
+        '''
+        self.keys[name] = tuple(key)
+        self.db.execute('INSERT OR REPLACE INTO {} VALUES (?, ?, ?, ?)'.format(self.table), (name, *key, pickle.dumps(value)))
+
+    def prune(self, names):
+        '''
+        remove entries that are not in names, call commit() to save
+        '''
+        names = set(names)
+        removed = [name for name in self.keys.keys() if name not in names]
+        if removed:
+            self.log.info('{}: removing {} cached entries'.format(self.table, len(removed)))
+            self.db.executemany('DELETE FROM {} WHERE name = ?'.format(self.table), [(name,) for name in removed])
+            for name in removed:
+                self.keys.pop(name)
+
+    def commit(self):
+        self.db.commit()
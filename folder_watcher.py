@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# watch the image folder for changes using inotify (linux only), so new files are found in seconds without rescanning the folder
+# files are only reported when they have finished being written (closed), and events are debounced so a batch of files is one change
+# if inotify is not available, start() returns False and the folder is scanned periodically instead
+
+import asyncio
+import os
+import sys
+import time
+import struct
+import ctypes
+import ctypes.util
+import logging
+
+HAVE_INOTIFY = False
+try:
+    if sys.platform.startswith('linux'):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+        HAVE_INOTIFY=True
+except (OSError, AttributeError):
+    pass
+
+__version__ = '1.0.1'
+
+logging.basicConfig(level=logging.INFO)
+
+#inotify constants from <sys/inotify.h>
+IN_MODIFY       = 0x00000002
+IN_ATTRIB       = 0x00000004
+IN_CLOSE_WRITE  = 0x00000008
+IN_MOVED_FROM   = 0x00000040
+IN_MOVED_TO     = 0x00000080
+IN_CREATE       = 0x00000100
+IN_DELETE       = 0x00000200
+IN_DELETE_SELF  = 0x00000400
+IN_MOVE_SELF    = 0x00000800
+IN_Q_OVERFLOW   = 0x00004000
+IN_IGNORED      = 0x00008000
+IN_ISDIR        = 0x40000000
+IN_NONBLOCK     = 0o4000
+IN_CLOEXEC      = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT = struct.Struct('iIII')   #wd, mask, cookie, len (followed by name)
+
+class FolderWatcher:
+
+    def __init__(self, folder, debounce=1, settle_timeout=60):
+        '''
+        folder: folder to watch (not recursive)
+        debounce: seconds with no new events before waiters are woken up
+        settle_timeout: files that are created or modified but not closed are treated as complete after this many seconds
+        '''
+        self.log = logging.getLogger('Main.'+__class__.__name__)
+        self.folder = folder
+        self.debounce = debounce
+        self.settle_timeout = settle_timeout
+        self.fd = None
+        self.settling = {}          #filename: time of last write, for files still being written
+        self.changed = set()        #filenames changed since last take()
+        self.rescan = True          #full scan needed (first scan, or events were lost)
+        self.event = asyncio.Event()
+        self.timer = None
+
+    @property
+    def running(self):
+        return self.fd is not None
+
+    def start(self):
+        '''
+        start watching folder, returns False if inotify is not available
+        '''
+        if not HAVE_INOTIFY:
+            self.log.info('inotify not available, scanning folder periodically')
+            return False
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            self.log.warning('inotify_init failed: {}'.format(os.strerror(ctypes.get_errno())))
+            return False
+        if libc.inotify_add_watch(fd, os.fsencode(str(self.folder)), WATCH_MASK) < 0:
+            self.log.warning('unable to watch folder: {}, {}'.format(self.folder, os.strerror(ctypes.get_errno())))
+            os.close(fd)
+            return False
+        asyncio.get_running_loop().add_reader(fd, self.read_events)
+        self.fd = fd
+        self.log.info('watching folder: {}'.format(self.folder))
+        return True
+
+    def stop(self):
+        '''
+        stop watching folder, and wake up anything waiting
+        '''
+        if self.running:
+            asyncio.get_running_loop().remove_reader(self.fd)
+            os.close(self.fd)
+            self.fd = None
+        self.rescan = True
+        self.event.set()
+
+    def read_events(self):
+        '''
+        called by the event loop when the inotify file descriptor is readable
+        '''
+        try:
+            data = os.read(self.fd, 64*1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + EVENT.size <= len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset+EVENT.size:offset+EVENT.size+length].rstrip(b'\0'))
+            offset += EVENT.size + length
+            self.handle_event(mask, name)
+
+    def handle_event(self, mask, name):
+        '''
+        track files being written, and files that have changed
+        '''
+        self.log.debug('event: {:#x} {}'.format(mask, name))
+        if mask & IN_Q_OVERFLOW:
+            self.log.warning('inotify queue overflow, rescanning folder')
+            self.rescan = True
+        elif mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+            self.log.warning('folder: {} removed, scanning folder periodically'.format(self.folder))
+            self.stop()
+            return
+        elif mask & IN_ISDIR or not name:
+            return
+        elif mask & (IN_CREATE | IN_MODIFY):
+            self.settling[name] = time.time()      #wait for IN_CLOSE_WRITE
+            return
+        elif mask & IN_ATTRIB and name in self.settling:
+            return
+        else:   #IN_CLOSE_WRITE, IN_MOVED_TO, IN_MOVED_FROM, IN_DELETE, IN_ATTRIB
+            self.settling.pop(name, None)
+            self.changed.add(name)
+        self.notify()
+
+    def notify(self):
+        '''
+        wake up waiters when no more events have arrived for debounce seconds
+        '''
+        if self.timer:
+            self.timer.cancel()
+        self.timer = asyncio.get_running_loop().call_later(self.debounce, self.event.set)
+
+    def is_settling(self, filename):
+        '''
+        True if filename is still being written
+        '''
+        return time.time() - self.settling.get(filename, 0) < self.settle_timeout
+
+    def take(self):
+        '''
+        return set of filenames changed since last call, or None if the whole folder should be scanned
+        '''
+        for name, updated in list(self.settling.items()):
+            if time.time() - updated >= self.settle_timeout:
+                self.log.info('file: {} was not closed, treating it as complete'.format(name))
+                self.settling.pop(name)
+                self.changed.add(name)
+        changed, self.changed = self.changed, set()
+        if self.rescan or not self.running:
+            self.rescan = False
+            return None
+        return changed
+
+    def restore(self, changed):
+        '''
+        put back changes returned by take() that could not be handled, so the next take() returns them again
+        '''
+        if changed is None:
+            self.rescan = True
+        else:
+            self.changed.update(changed)
+
+    async def wait(self, timeout):
+        '''
+        wait up to timeout seconds for changes, returns True if there were changes
+        '''
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.event.clear()
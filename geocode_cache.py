@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# cache of reverse geocoded addresses, keyed by latitude and longitude rounded to precision decimal places (3 is about 100m)
+# so photos taken at the same place only need one lookup, and renamed files keep their address
+# places with no address are cached too, so they are not looked up again
+# the least recently used places are removed when there are more than max_cells, and the cache is saved as json
+
+import json
+from collections import OrderedDict
+from pathlib import Path
+import logging
+
+__version__ = '1.0.0'
+
+logging.basicConfig(level=logging.INFO)
+
+class GeocodeCache:
+
+    def __init__(self, path='./geocode_cache.json', precision=3, max_cells=10000):
+        self.log = logging.getLogger('Main.'+__class__.__name__)
+        self.path = Path(path)
+        self.precision = precision
+        self.max_cells = max_cells
+        self.cells = OrderedDict()      #cell: address (None if there is no address), least recently used first
+        self.files = {}                 #filename: cell
+        self.loaded = False
+
+    def get_cell(self, lat, lng):
+        '''
+        return cache key for lat, lng
+        '''
+        return '{:.{p}f},{:.{p}f}'.format(round(lat, self.precision) or 0.0, round(lng, self.precision) or 0.0, p=self.precision)
+
+    def load(self):
+        '''
+        load cache from file, returns False if there is no cache file (or it can't be read)
+        places saved with a different precision are discarded, but the cache file still counts as loaded
+        '''
+        self.loaded = True
+        if not self.path.is_file():
+            return False
+        try:
+            data = json.loads(self.path.read_text())
+        except ValueError as e:
+            self.log.warning('unable to read: {}, {}'.format(self.path, e))
+            return False
+        if data.get('precision') == self.precision:
+            self.cells = OrderedDict(data.get('cells', {}))
+            self.files = {k: v for k, v in data.get('files', {}).items() if v in self.cells}
+        else:
+            self.log.info('precision changed from {} to {}, discarding cached places'.format(data.get('precision'), self.precision))
+        self.log.info('loaded {} places'.format(len(self.cells)))
+        return True
+
+    def save(self):
+        '''
+        save cache to file
+        '''
+        data = {'precision': self.precision,
+                'cells': self.cells,
+                'files': {k: v for k, v in self.files.items() if v in self.cells}}
+        tmp = self.path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(data, indent=2))
+        tmp.replace(self.path)
+
+    def prune(self, files):
+        '''
+        forget files that are not in files (the places are kept, in case the files come back)
+        '''
+        files = set(files)
+        self.files = {k: v for k, v in self.files.items() if k in files}
+
+    def has_file(self, file):
+        '''
+        True if the address (or lack of one) for file is cached
+        '''
+        return self.files.get(file) in self.cells
+
+    def get_file(self, file):
+        '''
+        return cached address for file, or None if there is no address, or it is not cached
+        '''
+        cell = self.files.get(file)
+        if cell in self.cells:
+            self.cells.move_to_end(cell)
+            return self.cells[cell]
+        return None
+
+    def put(self, file, lat, lng, address):
+        '''
+        save address for file at lat, lng
+        '''
+        cell = self.get_cell(lat, lng)
+        self.cells[cell] = address
+        self.cells.move_to_end(cell)
+        self.files[file] = cell
+        while len(self.cells) > self.max_cells:
+            self.cells.popitem(last=False)
+
+    async def lookup(self, file, lat, lng, reverse):
+        '''
+        return address for file at lat, lng from the cache, or from coroutine function reverse(lat, lng) if it is not cached
+        the result is cached even if there is no address, but not if reverse raises an exception
+        '''
+        cell = self.get_cell(lat, lng)
+        if cell in self.cells:
+            self.log.debug('{}: using cached address for: {}'.format(file, cell))
+            address = self.cells[cell]
+        else:
+            address = await reverse(lat, lng)
+        self.put(file, lat, lng, address)
+        return address
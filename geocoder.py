@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# reverse geocoders, find the address for a latitude and longitude
+# nominatim uses the OpenStreetMap web service (needs geopy, pip install geopy), limited to one request every 1.5 seconds
+# offline uses a local GeoNames places file (eg cities1000.txt from https://download.geonames.org/export/dump/), no internet needed
+# both return the address in the same format as nominatim, ie {'address': {'city': ..., 'state': ..., 'country': ...}, 'display_name': ...}
+
+import asyncio
+import csv
+import math
+from pathlib import Path
+HAVE_GEOPY = False
+try:
+    from geopy.geocoders import Nominatim
+    from geopy.adapters import AioHTTPAdapter
+    from geopy.extra.rate_limiter import AsyncRateLimiter
+    from geopy.exc import GeocoderTimedOut
+    HAVE_GEOPY=True
+except ImportError:
+    pass
+import logging
+
+__version__ = '1.0.1'
+
+logging.basicConfig(level=logging.INFO)
+
+class GeocodeError(Exception):
+    '''
+    lookup failed, but may work if tried again later
+    '''
+
+def distance(lat1, lng1, lat2, lng2):
+    '''
+    great circle distance between two points (km)
+    '''
+    lat1, lng1, lat2, lng2 = map(math.radians, [lat1, lng1, lat2, lng2])
+    a = math.sin((lat2-lat1)/2)**2 + math.cos(lat1)*math.cos(lat2)*math.sin((lng2-lng1)/2)**2
+    return 6371 * 2 * math.asin(min(1, math.sqrt(a)))
+
+class NominatimGeocoder:
+    '''
+    OpenStreetMap Nominatim web service
+    This is free, but limited to calling once per second, with a unique user_agent name for the app
+    see https://operations.osmfoundation.org/policies/nominatim/
+    '''
+
+    def __init__(self, user_agent):
+        self.log = logging.getLogger('Main.'+__class__.__name__)
+        self.user_agent = user_agent
+        self.geolocator = None
+        self.limited_reverse = None
+
+    async def __aenter__(self):
+        self.geolocator = await Nominatim(user_agent=self.user_agent, timeout=20, adapter_factory=AioHTTPAdapter).__aenter__()
+        self.limited_reverse = AsyncRateLimiter(self.geolocator.reverse, min_delay_seconds=1.5, max_retries=1, swallow_exceptions=False)
+        return self
+
+    async def __aexit__(self, *args):
+        await self.geolocator.__aexit__(*args)
+
+    async def reverse(self, lat, lng):
+        '''
+        return raw nominatim address for lat, lng, or None if there isn't one
+        raises GeocodeError if the request times out
+        '''
+        try:
+            locname = await self.limited_reverse(f"{lat}, {lng}")
+            return locname.raw if locname else None
+        except (asyncio.exceptions.TimeoutError, GeocoderTimedOut) as e:
+            await asyncio.sleep(5)
+            raise GeocodeError(e)
+
+class OfflineGeocoder:
+    '''
+    nearest place lookup in a local places file
+    the file can be a GeoNames dump (tab separated, no header, eg cities1000.txt), admin1CodesASCII.txt and countryInfo.txt
+    from the same site are used for state and country names if they are in the same folder,
+    or a csv file with a header row, with columns latitude, longitude, name (or city, town, village), and optionally county, state, country
+    places are indexed in a grid of cell_size degree cells, so only nearby cells are searched
+    '''
+
+    cell_size = 1               #degrees
+    max_distance = 50           #places further away than this (km) are not returned
+
+    def __init__(self, data_file):
+        self.log = logging.getLogger('Main.'+__class__.__name__)
+        self.data_file = Path(data_file)
+        self.grid = {}          #(lat cell, lng cell): list of (lat, lng, address)
+        self.count = 0
+        self.load_task = None
+
+    async def __aenter__(self):
+        '''
+        load the places file the first time, raises GeocodeError if it can't be loaded (it is loaded again next time)
+        '''
+        if not self.load_task:
+            self.load_task = asyncio.create_task(asyncio.to_thread(self.load))
+        try:
+            await self.load_task
+        except GeocodeError:
+            self.load_task = None
+            raise
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def get_cell(self, lat, lng):
+        return (math.floor(lat / self.cell_size), math.floor(lng / self.cell_size))
+
+    def wrap(self, lng_cell):
+        '''
+        wrap longitude cell around at 180 degrees, so places on the other side are found
+        '''
+        half = 180 // self.cell_size
+        return (lng_cell + half) % (2 * half) - half
+
+    def load(self):
+        '''
+        read places file into the grid index
+        raises GeocodeError if the file can't be read, or has no places in it, so a missing file doesn't look like there is no place nearby
+        '''
+        self.grid, self.count = {}, 0
+        self.log.info('loading places from: {}'.format(self.data_file))
+        try:
+            with self.data_file.open(encoding='utf-8', newline='') as f:
+                header = f.readline()
+                f.seek(0)
+                places = self.read_csv(f) if 'latitude' in header.lower() else self.read_geonames(f)
+                for lat, lng, address in places:
+                    self.grid.setdefault(self.get_cell(lat, lng), []).append((lat, lng, address))
+                    self.count += 1
+        except (OSError, ValueError, csv.Error) as e:
+            self.grid, self.count = {}, 0
+            raise GeocodeError('unable to read places file: {}, {}'.format(self.data_file, e))
+        if not self.count:
+            raise GeocodeError('no places found in: {}'.format(self.data_file))
+        self.log.info('loaded {} places'.format(self.count))
+
+    def read_geonames(self, f):
+        '''
+        yield (lat, lng, address) from GeoNames dump file
+        '''
+        admin1 = self.read_names('admin1CodesASCII.txt', 0, 1)
+        countries = self.read_names('countryInfo.txt', 0, 4)
+        for row in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+            if len(row) < 15 or row[6] != 'P':      #populated places only
+                continue
+            address = {self.place_type(row[7], int(row[14] or 0)): row[1],
+                       'state': admin1.get('{}.{}'.format(row[8], row[10]), row[10]),
+                       'country': countries.get(row[8], row[8]),
+                       'country_code': row[8].lower()}
+            yield float(row[4]), float(row[5]), address
+
+    def read_names(self, filename, key, value):
+        '''
+        return dictionary of code: name from GeoNames file in the same folder as the places file, or {} if there isn't one
+        '''
+        path = self.data_file.with_name(filename)
+        names = {}
+        if path.is_file():
+            with path.open(encoding='utf-8', newline='') as f:
+                for row in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+                    if len(row) > max(key, value) and not row[0].startswith('#'):
+                        names[row[key]] = row[value]
+        return names
+
+    def place_type(self, feature_code, population):
+        '''
+        nominatim address key for a GeoNames populated place
+        '''
+        if feature_code in ['PPLC', 'PPLA', 'PPLA2'] or population >= 100000:
+            return 'city'
+        return 'town' if population >= 10000 else 'village'
+
+    def read_csv(self, f):
+        '''
+        yield (lat, lng, address) from csv file with a header row
+        '''
+        for row in csv.DictReader(f):
+            row = {k.strip().lower(): v.strip() for k, v in row.items() if k and v}
+            try:
+                lat, lng = float(row['latitude']), float(row['longitude'])
+            except (KeyError, ValueError):
+                continue
+            address = {k: row[k] for k in ['village', 'town', 'city', 'county', 'state', 'country'] if k in row}
+            if 'name' in row and not any(k in address for k in ['village', 'town', 'city']):
+                address['city'] = row['name']
+            yield lat, lng, address
+
+    def nearest(self, lat, lng):
+        '''
+        return (distance, address) of nearest place within max_distance, or (None, None)
+        searches rings of cells around lat, lng until no closer place can be found
+        '''
+        best, best_address = None, None
+        lat_cell, lng_cell = self.get_cell(lat, lng)
+        cell_km = 111 * self.cell_size * max(0.01, math.cos(math.radians(min(89, abs(lat) + self.cell_size))))  #min width of a cell
+        rings = int(self.max_distance / cell_km) + 1
+        for ring in range(rings + 1):
+            if best is not None and (ring - 1) * cell_km > best:
+                break
+            for i in range(lat_cell - ring, lat_cell + ring + 1):
+                for j in range(lng_cell - ring, lng_cell + ring + 1):
+                    if max(abs(i - lat_cell), abs(j - lng_cell)) != ring:
+                        continue
+                    for p_lat, p_lng, address in self.grid.get((i, self.wrap(j)), []):
+                        d = distance(lat, lng, p_lat, p_lng)
+                        if best is None or d < best:
+                            best, best_address = d, address
+        if best is None or best > self.max_distance:
+            return None, None
+        return best, best_address
+
+    async def reverse(self, lat, lng):
+        '''
+        return address of nearest place to lat, lng in the same format as nominatim, or None if there isn't one
+        '''
+        d, address = self.nearest(lat, lng)
+        if not address:
+            return None
+        self.log.debug('nearest place to {}, {} is {:.1f} km away'.format(lat, lng, d))
+        return {'address': dict(address),
+                'display_name': ', '.join(address[k] for k in ['village', 'town', 'city', 'county', 'state', 'country'] if address.get(k)),
+                'lat': str(lat), 'lon': str(lng)}
+
+def get_geocoder(name='nominatim', data_file=None, user_agent='SamsungtvwsGetLocGallery'):
+    '''
+    return geocoder backend name, or None if it is not available
+    '''
+    if name == 'offline':
+        if data_file and Path(data_file).is_file():
+            return OfflineGeocoder(data_file)
+        logging.getLogger('Main').warning('offline geocoder needs a places file, {} not found, addresses are disabled'.format(data_file))
+    elif name == 'nominatim' and HAVE_GEOPY:
+        return NominatimGeocoder(user_agent)
+    return None
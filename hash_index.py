@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# index of 64 bit perceptual hashes, finds exact matches, and near matches by hamming distance
+# near matches use multi-index hashing: the hash is split into bands, and two hashes that differ by
+# less than the number of bands must have at least one band the same, so only those candidates are checked
+
+import logging
+
+__version__ = '1.0.0'
+
+logging.basicConfig(level=logging.INFO)
+
+class HashIndex:
+
+    def __init__(self, bits=64, bands=8):
+        self.log = logging.getLogger('Main.'+__class__.__name__)
+        self.bands = bands
+        self.band_bits = bits // bands
+        self.mask = (1 << self.band_bits) - 1
+        self.max_distance = bands - 1     #largest distance that is guaranteed to be found
+        self.hashes = {}                  #hash: [keys]
+        self.band_index = [{} for _ in range(bands)]
+
+    def __len__(self):
+        return sum(len(v) for v in self.hashes.values())
+
+    def get_bands(self, value):
+        '''
+        split hash value into bands
+        '''
+        return [(value >> (i*self.band_bits)) & self.mask for i in range(self.bands)]
+
+    def add(self, key, value):
+        '''
+        add key with hash value to index
+        '''
+        if value not in self.hashes:
+            for i, band in enumerate(self.get_bands(value)):
+                self.band_index[i].setdefault(band, set()).add(value)
+        self.hashes.setdefault(value, []).append(key)
+
+    def exact(self, value):
+        '''
+        return list of keys with exactly this hash value
+        '''
+        return self.hashes.get(value, [])
+
+    def search(self, value, max_distance=None):
+        '''
+        return list of (distance, key) with hamming distance <= max_distance from value, closest first
+        '''
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        candidates = set()
+        for i, band in enumerate(self.get_bands(value)):
+            candidates.update(self.band_index[i].get(band, ()))
+        results = []
+        for candidate in candidates:
+            distance = (candidate ^ value).bit_count()
+            if distance <= max_distance:
+                results.extend((distance, key) for key in self.hashes[candidate])
+        results.sort(key=lambda x: x[0])
+        return results
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# single pass image probe, opens each image file once and extracts everything the gallery needs from it
+# (format, dimensions, exif, fingerprint and thumbnail), results are memoized by path, mtime and size
+# the format, dimensions and hash are also saved in a persistent store, so a restart does not have to open the files
+# full results (with exif and frame) are large, so only the most recent max_full of them are kept in memory
+# a probe that is not full only reads the image header (format and dimensions), the image is not decoded
+# needs PIL (pip install pillow)
+
+import asyncio
+import io
+from collections import OrderedDict
+from pathlib import Path
+HAVE_PIL = False
+try:
+    from PIL import Image, ImageFilter
+    HAVE_PIL=True
+except ImportError:
+    pass
+import logging
+
+from thumbnail_cache import save_thumbnail
+from file_cache import get_stat_key
+
+__version__ = '1.0.2'
+
+logging.basicConfig(level=logging.INFO)
+
+FRAME_SIZE = (384, 216)     #size of grayscale frame used to compare images with TV thumbnails
+HASH_SIZE = (9, 8)          #difference hash gives (9-1)*8 = 64 bits
+
+def get_frame(img):
+    '''
+    reduce image to small blurred grayscale frame, used to compare images
+    '''
+    return img.convert('L').resize(FRAME_SIZE).filter(ImageFilter.GaussianBlur(radius=2))
+
+def get_hash(frame):
+    '''
+    64 bit difference hash of frame, each bit is set if a pixel is brighter than the pixel to it's right
+    '''
+    pixels = list(frame.resize(HASH_SIZE, Image.BILINEAR).getdata())
+    width = HASH_SIZE[0]
+    value = 0
+    for row in range(HASH_SIZE[1]):
+        for col in range(width-1):
+            value = (value << 1) | (pixels[row*width+col] > pixels[row*width+col+1])
+    return value
+
+def fingerprint(img):
+    '''
+    return dictionary of comparison frame (as bytes) and perceptual hash for img
+    '''
+    frame = get_frame(img)
+    return {'frame': frame.tobytes(), 'hash': get_hash(frame)}
+
+def fingerprint_data(data):
+    '''
+    return fingerprint of image binary data (ie a thumbnail downloaded from the TV)
+    '''
+    return fingerprint(Image.open(io.BytesIO(data)))
+
+def frame_from_bytes(data):
+    '''
+    convert frame bytes (from probe) back into an image
+    '''
+    return Image.frombytes('L', FRAME_SIZE, data)
+
+def probe_file(path, thumbnail_path=None, thumbnail_size=None, full=True):
+    '''
+    open image file once, and return dictionary of:
+    format: image format (lower case)
+    size: (width, height)
+    exif: raw exif tags (tag number: value)
+    frame: bytes of grayscale comparison frame
+    hash: 64 bit perceptual hash of frame
+    if thumbnail_path is given, the thumbnail is also saved there from the same decoded image
+    if full is False, only format and size are returned, and the image is not decoded
+    '''
+    with Image.open(path) as img:
+        result = {'format': img.format.lower(),
+                  'size': img.size}
+        if not full:
+            return result
+        result['exif'] = getattr(img, '_getexif', lambda: None)() or {}     #NOTE: have to use _getexif() getexif() is different
+        img.load()
+        result.update(fingerprint(img))
+        if thumbnail_path and not Path(thumbnail_path).is_file():
+            save_thumbnail(img, thumbnail_path, thumbnail_size)
+    return result
+
+class ImageProbe:
+
+    stored = ['format', 'size', 'hash']    #fields saved in the persistent store
+
+    def __init__(self, thumbnails=None, pool=None, store=None, max_full=100):
+        self.log = logging.getLogger('Main.'+__class__.__name__)
+        self.thumbnails = thumbnails    #optional ThumbnailCache, thumbnails are made during the probe
+        self.pool = pool                #optional WorkerPool, used by aprobe
+        self.store = store              #optional FileCache, persistent store of probe results
+        self.max_full = max(1, max_full)    #max number of full results kept in memory
+        self.on_full = None             #optional function on_full(path, stat key, result), called when a file is fully probed
+        self.memo = {}                  #path: (stat key, stored fields)
+        self.full = OrderedDict()       #path: (stat key, full result), least recently used first
+
+    def get_thumbnail_args(self, path):
+        '''
+        return thumbnail path and size for probe_file, or (None, None) if there is no thumbnail cache
+        '''
+        if self.thumbnails:
+            return Path(self.thumbnails.cache_dir, self.thumbnails.get_key(Path(path).name)), self.thumbnails.size
+        return None, None
+
+    def get_memo(self, path, full=False):
+        '''
+        return (stat key, memoized result or None) for path
+        only the most recent full results are kept, so if full is True the file may have to be probed again
+        '''
+        key = get_stat_key(path)
+        if full:
+            memo = self.full.get(str(path))
+            if memo and memo[0] == key:
+                self.full.move_to_end(str(path))
+                return key, memo[1]
+            return key, None
+        memo = self.memo.get(str(path))
+        result = memo[1] if memo and memo[0] == key else None
+        if result is None and self.store:
+            result = self.store.get(str(path), key)
+            if result is not None:
+                self.memo[str(path)] = (key, result)
+        return key, result
+
+    def set_memo(self, path, key, result):
+        '''
+        memoize stored fields of result, and save them to store
+        a full result is kept until max_full newer results have been probed, and passed to on_full
+        '''
+        stored = {k:v for k, v in result.items() if k in self.stored}
+        self.memo[str(path)] = (key, stored)
+        if 'frame' in result:
+            self.full[str(path)] = (key, result)
+            self.full.move_to_end(str(path))
+            while len(self.full) > self.max_full:
+                self.full.popitem(last=False)
+            if self.on_full:
+                self.on_full(path, key, result)
+        if self.store:
+            self.store.put(str(path), key, stored)
+
+    def probe(self, path, full=False):
+        '''
+        return probe results for path, only opens the file if it has not been seen before, or has changed
+        set full to True if exif and frame are needed, not just the format and size
+        raises exception if the file can't be read
+        '''
+        if not HAVE_PIL:
+            return None
+        key, result = self.get_memo(path, full)
+        if result is None:
+            self.log.debug('probing: {}'.format(path))
+            result = probe_file(path, *self.get_thumbnail_args(path), full) if full else probe_file(path, full=False)
+            self.set_memo(path, key, result)
+            self.commit()
+        return result if full else self.memo[str(path)][1]
+
+    async def aprobe(self, path, full=False):
+        '''
+        async version of probe, the file is probed in the worker pool, so the event loop is not blocked
+        full probes decode the image, so they are run in a worker process, other probes only read the header
+        '''
+        if not HAVE_PIL:
+            return None
+        key, result = self.get_memo(path, full)
+        if result is None:
+            self.log.debug('probing: {}'.format(path))
+            if full:
+                args = (path, *self.get_thumbnail_args(path), True)
+                result = await (self.pool.run_cpu(probe_file, *args) if self.pool else asyncio.to_thread(probe_file, *args))
+            else:
+                result = await (self.pool.run_io(probe_file, path, None, None, False) if self.pool else asyncio.to_thread(probe_file, path, None, None, False))
+            self.set_memo(path, key, result)
+        return result if full else self.memo[str(path)][1]
+
+    async def aprobe_all(self, paths, full=False):
+        '''
+        probe list of paths concurrently, returns dictionary of path: result
+        files that can't be read are left out
+        for full results of a lot of files, use aprobe_batches, so they are not all held at once
+        '''
+        if self.pool:
+            results = await self.pool.map(lambda path: self.aprobe(path, full), paths)
+        else:
+            results = {}
+            for path in paths:
+                try:
+                    results[path] = await self.aprobe(path, full)
+                except Exception as e:
+                    self.log.warning('Error probing: {}, {}'.format(path, e))
+        self.commit()
+        return results
+
+    async def aprobe_batches(self, paths, full=False, batch=None, needed=None):
+        '''
+        async generator, probes paths in batches (of max_full by default) and yields dictionary of path: result for each batch
+        so only one batch of results is held at a time
+        if needed(path) is given, paths it returns False for (eg they have been probed by something else since) are skipped
+        '''
+        paths = list(paths)
+        batch = min(batch or self.max_full, self.max_full)
+        for i in range(0, len(paths), batch):
+            yield await self.aprobe_all([path for path in paths[i:i+batch] if not needed or needed(path)], full)
+
+    def commit(self):
+        if self.store:
+            self.store.commit()
+
+    def forget(self, files):
+        '''
+        remove memoized and stored results for paths not in files
+        '''
+        files = {str(f) for f in files}
+        self.memo = {k:v for k, v in self.memo.items() if k in files}
+        self.full = OrderedDict((k, v) for k, v in self.full.items() if k in files)
+        if self.store:
+            self.store.prune(files)
+            self.commit()
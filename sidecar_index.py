@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# index of the .TXT sidecar files that describe images in the folder, so finding the text file for an image doesn't read the whole folder
+# the index maps the (upper case) image name without extension to the text file, and is rebuilt only when the folder changes
+# (files added, removed or renamed change the modification time of the folder), parsed text files are cached by modification time
+
+import json
+from pathlib import Path
+import logging
+
+from file_cache import get_stat_key
+
+__version__ = '1.0.0'
+
+logging.basicConfig(level=logging.INFO)
+
+class SidecarIndex:
+
+    suffix = '.TXT'
+
+    def __init__(self, folder, loads=json.loads):
+        '''
+        folder: folder containing images and text files
+        loads: function to parse text file contents
+        '''
+        self.log = logging.getLogger('Main.'+__class__.__name__)
+        self.folder = Path(folder)
+        self.loads = loads
+        self.index = {}         #upper case stem: text file path
+        self.missing = set()    #names of files that have no text file
+        self.parsed = {}        #text file path: (stat key, parsed data)
+        self.folder_key = None
+
+    def refresh(self, force=False):
+        '''
+        rebuild index if the folder has changed (or force is True)
+        '''
+        try:
+            key = get_stat_key(self.folder)
+        except OSError:
+            key = None
+        if key == self.folder_key and not force:
+            return
+        self.folder_key = key
+        self.index = {}
+        files = []
+        for path in self.folder.iterdir() if key else []:
+            if path.suffix.upper() == self.suffix:
+                self.index[path.stem.upper()] = path
+            else:
+                files.append(path.name)
+        self.missing = {f for f in files if Path(f).stem.upper() not in self.index}
+        text_files = set(self.index.values())
+        self.parsed = {k: v for k, v in self.parsed.items() if k in text_files}
+        self.log.debug('indexed {} text files, {} files without text'.format(len(self.index), len(self.missing)))
+
+    def get(self, file):
+        '''
+        return path of text file for image file name, or None if there isn't one
+        '''
+        self.refresh()
+        if file in self.missing:
+            return None
+        return self.index.get(Path(file).stem.upper())
+
+    def read(self, file):
+        '''
+        return parsed contents of text file for image file name, or {} if there is no text file
+        the text file is only read again if it has changed
+        raises exception if the text file can't be parsed
+        '''
+        text_file = self.get(file)
+        if not text_file:
+            return {}
+        try:
+            key = get_stat_key(text_file)
+        except FileNotFoundError:
+            return {}
+        cached = self.parsed.get(text_file)
+        if cached and cached[0] == key:
+            return cached[1]
+        self.log.info('reading text file: {}'.format(text_file.name))
+        data = self.loads(text_file.read_text())
+        self.parsed[text_file] = (key, data)
+        return data
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# slideshow deck, keeps the order of images in the slideshow so the next (or previous) image can be found without rebuilding lists
+# sequential decks are kept sorted (by a key function) as a linked ring, shuffled decks show every image once before reshuffling
+# items can be added and removed at any time, without changing the order of the rest of the deck
+
+import random
+from bisect import bisect_left, insort
+from collections import deque
+import logging
+
+__version__ = '1.0.0'
+
+logging.basicConfig(level=logging.INFO)
+
+class SlideshowDeck:
+
+    def __init__(self, items=(), sequential=False, key=None, history=100):
+        '''
+        items: initial items (filenames or content_ids)
+        sequential: sorted order if True, otherwise shuffled
+        key: function that returns the sort key for an item (for sequential decks)
+        history: number of items remembered for prev()
+        '''
+        self.log = logging.getLogger('Main.'+__class__.__name__)
+        self.sequential = sequential
+        self.key = key or (lambda item: item)
+        self.items = {}                 #item: sort key
+        self.order = []                 #sorted list of (key, item), sequential only
+        self.links = {}                 #item: [prev, next], sequential only
+        self.deck = []                  #shuffled items, deck[index:] are still to be shown
+        self.index = 0
+        self.remaining = set()          #items in deck[index:]
+        self.history = deque(maxlen=history)
+        self.current = None
+        self.update(items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def update(self, items):
+        '''
+        add and remove items so the deck holds exactly items
+        '''
+        items = set(items)
+        for item in [i for i in self.items.keys() if i not in items]:
+            self.remove(item)
+        for item in items:
+            if item not in self.items:
+                self.add(item)
+
+    def add(self, item):
+        '''
+        add item to deck, in sort order (sequential) or at a random position in the rest of the deck (shuffled)
+        '''
+        if item in self.items:
+            return
+        key = (self.key(item), item)
+        self.items[item] = key
+        if self.sequential:
+            insort(self.order, key)
+            i = bisect_left(self.order, key)
+            prev, next = self.order[i-1][1], self.order[(i+1) % len(self.order)][1]
+            self.links[item] = [prev, next]
+            self.links[prev][1] = item
+            self.links[next][0] = item
+        elif item not in self.remaining:
+            self.remaining.add(item)
+            self.deck.append(item)
+            j = random.randint(self.index, len(self.deck)-1)
+            self.deck[j], self.deck[-1] = self.deck[-1], self.deck[j]
+
+    def remove(self, item):
+        '''
+        remove item from deck, if it is the current item, next() continues from where it was
+        '''
+        key = self.items.pop(item, None)
+        if key is None:
+            return
+        if self.sequential:
+            del self.order[bisect_left(self.order, key)]
+            prev, next = self.links.pop(item)
+            if prev != item:
+                self.links[prev][1] = next
+                self.links[next][0] = prev
+            if self.current == item:
+                self.current = prev if prev != item else None
+        elif self.current == item:
+            self.current = None     #removed items still in deck are skipped when they come up
+
+    def rekey(self, items):
+        '''
+        move items to their new place in a sequential deck, if their sort key has changed (eg exif data was loaded)
+        '''
+        if not self.sequential:
+            return
+        for item in items:
+            if item in self.items and self.items[item] != (self.key(item), item):
+                current = self.current == item
+                self.remove(item)
+                self.add(item)
+                if current:
+                    self.current = item
+
+    def set_current(self, item):
+        '''
+        set current item (eg when an image is selected manually), next() continues from here
+        '''
+        if item != self.current:
+            if self.current is not None:
+                self.history.append(self.current)
+            self.current = item
+
+    def next(self):
+        '''
+        return next item (not the current item), or None if there isn't one
+        '''
+        if self.sequential:
+            if self.current in self.links:
+                item = self.links[self.current][1]
+            else:
+                item = self.order[0][1] if self.order else None
+        else:
+            item = self.deal()
+        if item is None or item == self.current:
+            return None
+        self.set_current(item)
+        return item
+
+    def deal(self):
+        '''
+        return next item from the shuffled deck, reshuffling when every item has been shown
+        '''
+        for reshuffled in [False, True]:
+            while self.index < len(self.deck):
+                item = self.deck[self.index]
+                self.index += 1
+                self.remaining.discard(item)
+                if item in self.items and item != self.current:
+                    return item
+            if reshuffled or len(self.items) <= 1:
+                break
+            self.log.debug('reshuffling {} items'.format(len(self.items)))
+            self.deck = list(self.items.keys())
+            random.shuffle(self.deck)
+            if self.deck[0] == self.current:     #don't show the same item twice in a row
+                self.deck[0], self.deck[-1] = self.deck[-1], self.deck[0]
+            self.index = 0
+            self.remaining = set(self.deck)
+        return None
+
+    def prev(self):
+        '''
+        return previous item, or None if there isn't one
+        '''
+        if self.sequential:
+            item = self.links[self.current][0] if self.current in self.links else None
+            if item is not None and item != self.current:
+                self.set_current(item)
+                return item
+            return None
+        while self.history:
+            item = self.history.pop()
+            if item in self.items and item != self.current:
+                self.current = item
+                return item
+        return None
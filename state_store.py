@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# crash safe store for the program data (uploaded files and last update time)
+# the data is kept in a snapshot file (same format as uploaded_files.json always was), plus an append-only journal of changes
+# each save only appends the entries that changed, and the journal is folded into the snapshot (written atomically) every so often
+
+import os
+import json
+from pathlib import Path
+import logging
+
+__version__ = '1.0.0'
+
+logging.basicConfig(level=logging.INFO)
+
+class StateStore:
+
+    def __init__(self, path='./uploaded_files.json', compact_after=200):
+        '''
+        path: snapshot file, the journal is saved next to it with a .journal extension
+        compact_after: number of journal entries before the journal is folded into the snapshot
+        '''
+        self.log = logging.getLogger('Main.'+__class__.__name__)
+        self.path = Path(path)
+        self.journal_path = self.path.with_suffix('.journal')
+        self.compact_after = compact_after
+        self.uploaded_files = None      #last saved state
+        self.last_update = None
+        self.journal_entries = 0
+
+    def load(self):
+        '''
+        load snapshot and replay journal, returns (uploaded_files, last_update), last_update is None if not saved
+        '''
+        self.uploaded_files, self.last_update = {}, None
+        if self.path.is_file():
+            try:
+                program_data = json.loads(self.path.read_text())
+                self.uploaded_files = program_data.get('uploaded_files', program_data)
+                self.last_update = program_data.get('last_update')
+            except ValueError as e:
+                self.log.error('unable to read: {}, {}'.format(self.path, e))
+        self.journal_entries = 0
+        if self.journal_path.is_file():
+            with self.journal_path.open() as f:
+                for line in f:
+                    try:
+                        self.apply(json.loads(line))
+                        self.journal_entries += 1
+                    except ValueError:
+                        self.log.warning('ignoring incomplete journal entry in: {}'.format(self.journal_path))
+            self.log.info('replayed {} journal entries'.format(self.journal_entries))
+            self.compact()      #also removes any incomplete entry, so it can't corrupt the next one
+        self.uploaded_files = {k: dict(v) for k, v in self.uploaded_files.items()}
+        return {k: dict(v) for k, v in self.uploaded_files.items()}, self.last_update
+
+    def apply(self, entry):
+        '''
+        apply one journal entry to the saved state
+        '''
+        for name in entry.get('removed', []):
+            self.uploaded_files.pop(name, None)
+        self.uploaded_files.update(entry.get('changed', {}))
+        self.last_update = entry.get('last_update', self.last_update)
+
+    def save(self, uploaded_files, last_update):
+        '''
+        append changes since the last save to the journal
+        '''
+        if self.uploaded_files is None:
+            self.load()
+        entry = {}
+        changed = {k: dict(v) for k, v in uploaded_files.items() if self.uploaded_files.get(k) != v}
+        removed = [k for k in self.uploaded_files.keys() if k not in uploaded_files]
+        if changed:
+            entry['changed'] = changed
+        if removed:
+            entry['removed'] = removed
+        if last_update != self.last_update:
+            entry['last_update'] = last_update
+        if not entry:
+            return
+        with self.journal_path.open('a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.apply(entry)
+        self.journal_entries += 1
+        if self.journal_entries >= self.compact_after:
+            self.compact()
+
+    def compact(self):
+        '''
+        write saved state to the snapshot file atomically, then clear the journal
+        '''
+        program_data = {'last_update': self.last_update, 'uploaded_files': self.uploaded_files}
+        tmp = self.path.with_suffix('.tmp')
+        with tmp.open('w') as f:
+            f.write(json.dumps(program_data, indent=2))
+            f.flush()
+            os.fsync(f.fileno())
+        tmp.replace(self.path)
+        self.journal_path.unlink(missing_ok=True)
+        self.journal_entries = 0
+        self.log.debug('saved: {}'.format(self.path))
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# on-disk thumbnail cache for the web interface, so browsers don't have to download the full size images
+# needs PIL (pip install pillow), if PIL is not installed the original images are used instead
+
+import hashlib
+from pathlib import Path
+HAVE_PIL = False
+try:
+    from PIL import Image, ImageOps
+    HAVE_PIL=True
+except ImportError:
+    pass
+import logging
+
+__version__ = '1.0.0'
+
+logging.basicConfig(level=logging.INFO)
+
+def save_thumbnail(img, path, size, quality=85):
+    '''
+    resize PIL image to fit in size and save as jpeg in path
+    '''
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail(size)
+    tmp = Path(path).with_suffix('.tmp')
+    img.convert('RGB').save(tmp, 'JPEG', quality=quality, optimize=True)
+    tmp.replace(path)               #don't leave partial files in the cache
+
+class ThumbnailCache:
+    '''
+    Thumbnails are stored as jpeg files in cache_dir, named <filename hash>_<mtime>_<size>.jpg
+    so a changed file never matches an old thumbnail, and the cache survives restarts
+    '''
+
+    quality = 85
+
+    def __init__(self, folder, cache_dir='./thumbnails', size=960):
+        self.log = logging.getLogger('Main.'+__class__.__name__)
+        self.folder = Path(folder)
+        self.cache_dir = Path(cache_dir)
+        self.size = (size, size)
+        if HAVE_PIL:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        else:
+            self.log.warning('PIL not installed, thumbnails disabled')
+
+    def name_hash(self, filename):
+        '''
+        return hash of filename, used as prefix for cache file names
+        '''
+        return hashlib.md5(filename.encode()).hexdigest()
+
+    def get_key(self, filename):
+        '''
+        return cache file name for filename, keyed by filename, mtime and size
+        '''
+        stat = Path(self.folder, filename).stat()
+        return '{}_{}_{}.jpg'.format(self.name_hash(filename), stat.st_mtime_ns, stat.st_size)
+
+    def get(self, filename):
+        '''
+        return path to thumbnail of filename, making it if it is not in the cache
+        returns None if no thumbnail is available
+        '''
+        if HAVE_PIL:
+            try:
+                path = Path(self.cache_dir, self.get_key(filename))
+                if not path.is_file():
+                    self.evict(filename)
+                    self.make_thumbnail(Path(self.folder, filename), path)
+                return path
+            except Exception as e:
+                self.log.warning('error making thumbnail for: {}, {}'.format(filename, e))
+        return None
+
+    def make_thumbnail(self, source, path):
+        '''
+        resize source image to fit in self.size and save as jpeg in path
+        '''
+        self.log.info('making thumbnail for: {}'.format(source.name))
+        with Image.open(source) as img:
+            img.draft('RGB', self.size)     #fast jpeg decode at reduced size
+            save_thumbnail(img, path, self.size, self.quality)
+
+    def evict(self, filename):
+        '''
+        remove all cached thumbnails for filename
+        '''
+        for path in self.cache_dir.glob('{}_*.jpg'.format(self.name_hash(filename))):
+            self.log.debug('removing thumbnail: {}'.format(path.name))
+            path.unlink(missing_ok=True)
+
+    def prune(self, files):
+        '''
+        remove cached thumbnails that don't match the current version of a file in files
+        (ie the file has been modified or removed)
+        '''
+        if not HAVE_PIL:
+            return
+        valid = set()
+        for file in files:
+            try:
+                valid.add(self.get_key(file))
+            except OSError:
+                pass
+        for path in self.cache_dir.glob('*.jpg'):
+            if path.name not in valid:
+                self.log.info('removing stale thumbnail: {}'.format(path.name))
+                path.unlink(missing_ok=True)
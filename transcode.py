@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# convert images to jpeg at the TV panel resolution before uploading, so large files don't have to be sent to the TV
+# converted files are cached by content, so uploading the same file again (eg after the TV is reset) is fast
+# needs PIL (pip install pillow), if PIL is not installed the original files are uploaded
+
+from pathlib import Path
+HAVE_PIL = False
+try:
+    from PIL import Image, ImageOps
+    HAVE_PIL=True
+except ImportError:
+    pass
+import logging
+
+from file_cache import get_content_hash
+
+__version__ = '1.0.0'
+
+logging.basicConfig(level=logging.INFO)
+
+def fit_size(image_size, size):
+    '''
+    return size rotated to the same orientation as image_size, so portrait images are not reduced to the landscape height
+    '''
+    return size if image_size[0] >= image_size[1] else size[::-1]
+
+def transcode_file(source, cache_dir, size, quality=90):
+    '''
+    convert image file source to a jpeg that fits in size (either orientation), with metadata removed
+    the result is saved in cache_dir named by a hash of the content of source, returns the path of the jpeg
+    this is a module level function, so it can be run in a worker process
+    '''
+    path = Path(cache_dir, '{}_{}x{}_{}.jpg'.format(get_content_hash(source), *size, quality))
+    if path.is_file():
+        path.touch()        #mark as recently used
+        return path
+    with Image.open(source) as img:
+        img.draft('RGB', (min(size), min(size)))    #fast jpeg decode at reduced size, still larger than the target
+        img = ImageOps.exif_transpose(img)          #rotate now, as the exif orientation tag is not kept
+        img.thumbnail(fit_size(img.size, size), Image.LANCZOS)
+        tmp = path.with_suffix('.tmp')
+        img.convert('RGB').save(tmp, 'JPEG', quality=quality, optimize=True, icc_profile=img.info.get('icc_profile'))
+    tmp.replace(path)       #don't leave partial files in the cache
+    return path
+
+class Transcoder:
+    '''
+    Converted files are stored in cache_dir, named <content hash>_<width>x<height>_<quality>.jpg
+    the least recently used files are removed when there are more than max_files
+    '''
+
+    def __init__(self, cache_dir='./transcoded', size=(3840, 2160), quality=90, max_files=500, pool=None):
+        self.log = logging.getLogger('Main.'+__class__.__name__)
+        self.cache_dir = Path(cache_dir)
+        self.size = tuple(size)
+        self.quality = quality
+        self.max_files = max_files
+        self.pool = pool                #optional WorkerPool
+        if HAVE_PIL:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self.log.info('transcoding uploads to jpeg at {}x{}'.format(*self.size))
+        else:
+            self.log.warning('PIL not installed, transcoding disabled')
+
+    def needed(self, file_type, image_size):
+        '''
+        return True if an image of file_type and image_size (width, height) should be transcoded
+        ie it is not a jpeg, or it is larger than the target size
+        '''
+        if not HAVE_PIL:
+            return False
+        box = fit_size(image_size, self.size)
+        return file_type != 'jpeg' or image_size[0] > box[0] or image_size[1] > box[1]
+
+    async def get(self, source):
+        '''
+        return path of transcoded jpeg for source, or None if it can't be converted
+        '''
+        try:
+            self.log.info('transcoding: {}'.format(Path(source).name))
+            if self.pool:
+                path = await self.pool.run_cpu(transcode_file, source, self.cache_dir, self.size, self.quality)
+                await self.pool.run_io(self.prune)
+            else:
+                path = transcode_file(source, self.cache_dir, self.size, self.quality)
+                self.prune()
+            return path
+        except Exception as e:
+            self.log.warning('error transcoding: {}, {}'.format(source, e))
+        return None
+
+    def prune(self):
+        '''
+        remove least recently used files if the cache has more than max_files
+        '''
+        files = sorted(self.cache_dir.glob('*.jpg'), key=lambda p: p.stat().st_mtime)
+        for path in files[:max(0, len(files) - self.max_files)]:
+            self.log.debug('removing transcoded file: {}'.format(path.name))
+            path.unlink(missing_ok=True)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# scheduler for commands sent to the TV, replaces a single lock around every TV command
+# commands have a priority (interactive > polling > bulk), and waiting commands are run highest priority first
+# bulk commands (uploads, deletes, thumbnails) can't use the reserved slots, so an interactive command never waits for a long upload to finish
+# identical queries that are already running are not sent again, all the callers get the result of the one that is running
+
+import asyncio
+import heapq
+import itertools
+import logging
+
+__version__ = '1.0.0'
+
+logging.basicConfig(level=logging.INFO)
+
+INTERACTIVE = 0     #user actions, eg selecting an image from the web page
+POLL = 1            #tv state queries
+BULK = 2            #uploads, deletes and thumbnail downloads
+
+class TVScheduler:
+
+    def __init__(self, slots=2, reserved=1):
+        '''
+        slots: max number of commands sent to the TV at once
+        reserved: number of slots that bulk commands can't use
+        '''
+        self.log = logging.getLogger('Main.'+__class__.__name__)
+        self.slots = max(1, slots)
+        self.reserved = min(max(0, reserved), self.slots-1)
+        self.running = {INTERACTIVE: 0, POLL: 0, BULK: 0}
+        self.waiting = []               #heap of (priority, sequence, future)
+        self.sequence = itertools.count()
+        self.in_flight = {}             #key: task, for queries that can be shared
+
+    def can_run(self, priority):
+        '''
+        True if a command of priority can start now
+        '''
+        running = sum(self.running.values())
+        if priority == BULK:
+            return running < self.slots - self.reserved
+        return running < self.slots
+
+    async def acquire(self, priority):
+        '''
+        wait for a free slot, commands waiting with a higher priority go first
+        '''
+        if (not self.waiting or self.waiting[0][0] > priority) and self.can_run(priority):
+            self.running[priority] += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (priority, next(self.sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(priority)      #slot was given to us just as we were cancelled
+            else:
+                self.waiting = [w for w in self.waiting if w[2] is not future]
+                heapq.heapify(self.waiting)
+            raise
+
+    def release(self, priority):
+        '''
+        free a slot, and start waiting commands (in priority order) that can now run
+        '''
+        self.running[priority] -= 1
+        while self.waiting and self.can_run(self.waiting[0][0]):
+            priority, _, future = heapq.heappop(self.waiting)
+            if not future.done():
+                self.running[priority] += 1
+                future.set_result(True)
+
+    async def run(self, priority, func, *args, key=None, **kwargs):
+        '''
+        run coroutine function func(*args, **kwargs) when a slot of priority is free, returns the result
+        if key is given and a command with the same key is already waiting or running, returns the result of that command instead
+        '''
+        if key is None:
+            return await self.execute(priority, func, *args, **kwargs)
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(self.execute(priority, func, *args, **kwargs))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda t: self.in_flight.pop(key, None) if self.in_flight.get(key) is t else None)
+        else:
+            self.log.debug('sharing result of: {}'.format(key))
+        return await asyncio.shield(task)     #cancelling one caller doesn't cancel the query for the others
+
+    async def execute(self, priority, func, *args, **kwargs):
+        await self.acquire(priority)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            self.release(priority)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# persistent cache of thumbnails downloaded from the TV, and their fingerprints, used when syncronizing files with the TV
+# content on the TV never changes for a given content_id, so a thumbnail only has to be downloaded (and fingerprinted) once
+# thumbnails are saved as <content_id>.jpg in cache_dir, fingerprints are saved in the sqlite file cache
+
+from pathlib import Path
+import logging
+
+from file_cache import FileCache
+
+__version__ = '1.0.0'
+
+logging.basicConfig(level=logging.INFO)
+
+class TVThumbnailCache:
+
+    key = (0, 0)    #content is immutable, so the file cache key never changes
+
+    def __init__(self, cache_dir='./tv_thumbnails'):
+        self.log = logging.getLogger('Main.'+__class__.__name__)
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.store = FileCache('tv_thumbnails')
+
+    def __contains__(self, content_id):
+        return content_id in self.store.keys
+
+    def get(self, content_id):
+        '''
+        return fingerprint of thumbnail for content_id, or None if it's not cached
+        '''
+        return self.store.get(content_id, self.key)
+
+    def put(self, content_id, data, fingerprint):
+        '''
+        save thumbnail data and fingerprint for content_id, call commit() to save the fingerprint
+        '''
+        path = Path(self.cache_dir, '{}.jpg'.format(content_id))
+        tmp = path.with_suffix('.tmp')
+        tmp.write_bytes(data)
+        tmp.replace(path)
+        self.store.put(content_id, self.key, fingerprint)
+
+    def prune(self, content_ids):
+        '''
+        remove thumbnails for content that is no longer on the TV (not in content_ids), call commit() to save
+        '''
+        content_ids = set(content_ids)
+        self.store.prune(content_ids)
+        for path in self.cache_dir.glob('*.jpg'):
+            if path.stem not in content_ids:
+                self.log.debug('removing thumbnail: {}'.format(path.name))
+                path.unlink(missing_ok=True)
+
+    def commit(self):
+        self.store.commit()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# pipelined upload engine, files are read (prepared) in the background while the current upload is in flight
+# the number of concurrent uploads is limited, and failed uploads are retried with exponential backoff
+
+import asyncio
+import logging
+
+__version__ = '1.0.1'
+
+logging.basicConfig(level=logging.INFO)
+
+class UploadPipeline:
+
+    def __init__(self, prepare, upload, in_flight=1, prefetch=2, retries=3, backoff=2):
+        '''
+        prepare: coroutine function prepare(item) returns data to upload, or None to skip item
+        upload: coroutine function upload(item, data) returns result, raises exception or returns None on failure
+        in_flight: max number of uploads at the same time
+        prefetch: max number of prepared items waiting to be uploaded
+        retries: number of times to retry a failed upload
+        backoff: delay before first retry (seconds), doubled for each retry
+        '''
+        self.log = logging.getLogger('Main.'+__class__.__name__)
+        self.prepare = prepare
+        self.upload = upload
+        self.in_flight = max(1, in_flight)
+        self.prefetch = max(1, prefetch)
+        self.retries = retries
+        self.backoff = backoff
+
+    async def run(self, items, on_result=None):
+        '''
+        prepare and upload all items, returns dictionary of item: result (None if the upload failed)
+        skipped items are not included
+        on_result(item, result) is called as each upload completes, exceptions it raises are logged
+        '''
+        queue = asyncio.Queue(self.prefetch)
+        results = {}
+
+        async def producer():
+            try:
+                for item in items:
+                    try:
+                        data = await self.prepare(item)
+                    except Exception as e:
+                        self.log.warning('error preparing: {}, {}'.format(item, e))
+                        continue
+                    if data is not None:
+                        await queue.put((item, data))
+            finally:
+                for _ in range(self.in_flight):
+                    await queue.put(None)
+
+        async def consumer():
+            while (job := await queue.get()) is not None:
+                item, data = job
+                results[item] = await self.upload_with_retry(item, data)
+                if on_result:
+                    try:
+                        on_result(item, results[item])
+                    except Exception as e:     #one bad item doesn't stop the rest of the batch
+                        self.log.warning('error handling upload of: {}, {}'.format(item, e))
+
+        tasks = [asyncio.create_task(producer())] + [asyncio.create_task(consumer()) for _ in range(self.in_flight)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        return results
+
+    async def upload_with_retry(self, item, data):
+        '''
+        upload item, retrying with exponential backoff if it fails
+        returns result or None
+        '''
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                result = await self.upload(item, data)
+                if result is not None:
+                    return result
+                self.log.warning('upload of: {} failed'.format(item))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.log.warning('upload of: {} failed: {}'.format(item, e))
+            if attempt < self.retries:
+                self.log.info('retrying upload of: {} in {}s ({}/{})'.format(item, delay, attempt+1, self.retries))
+                await asyncio.sleep(delay)
+                delay *= 2
+        return None
@@ -11,10 +11,33 @@
 # V 2.0.0 28/3/25 NW New version with seperate caption display
 # V 2.0.1 3/4/25  NW Minor fixes
 # V 2.0.2 4/4/25  NW Fix exif loading
+# V 2.1.0 18/10/26 NW Serve cached thumbnails for home page grid and modal header
+# V 2.1.1 18/10/26 NW Single pass image probe shared with exif and PIL sync
+# V 2.1.2 18/10/26 NW Added hash index and batch compare for syncronizing
+# V 2.1.3 18/10/26 NW Image processing moved to worker pool
+# V 2.2.0 18/10/26 NW Single TV poller shared by all websockets
+# V 2.2.1 18/10/26 NW Per websocket send queues, added /stats
+# V 2.3.0 18/10/26 NW Track TV state from TV events instead of polling
+# V 2.3.1 18/10/26 NW Pipelined uploads with retry
+# V 2.3.2 18/10/26 NW Optional transcoding to TV resolution before upload
+# V 2.3.3 18/10/26 NW Watch folder with inotify instead of rescanning
+# V 2.3.4 18/10/26 NW Renamed, touched and duplicate files are not uploaded again
+# V 2.3.5 18/10/26 NW Journaled, crash safe saving of uploaded_files.json
+# V 2.4.0 18/10/26 NW Added cache mode, TV only holds the files needed for the slideshow
+# V 2.4.1 18/10/26 NW Slideshow deck, sequential slideshow by name or date
+# V 2.4.2 18/10/26 NW Cache TV content lists
+# V 2.4.3 18/10/26 NW Keep TV thumbnails between restarts
+# V 2.4.4 18/10/26 NW Syncronize in the background, resume after restart
+# V 2.4.5 18/10/26 NW Limit number of image probes held in memory
+# V 2.4.6 18/10/26 NW Schedule TV commands by priority
+# V 2.4.7 18/10/26 NW Cache rendered modal and caption html
+# V 2.4.8 18/10/26 NW Index text files, instead of searching the folder for each one
+# V 2.4.9 18/10/26 NW Added offline geocoder
+# V 2.5.0 18/10/26 NW Cache addresses by location, not filename
 
 import quart_flask_patch
 import asyncio
-from quart import Quart, render_template, make_response, current_app, websocket
+from quart import Quart, render_template, make_response, current_app, websocket, send_from_directory
 from flask_bootstrap import Bootstrap5
 from pathlib import Path
 from tempfile import TemporaryDirectory
@@ -25,12 +48,28 @@ from hypercorn.config import Config
 from hypercorn.asyncio import serve
 
 from async_art_gallery_web import monitor_and_display
+from file_cache import get_stat_key
 from exif_data import ExifData
+from thumbnail_cache import ThumbnailCache
+from broadcast import Hub
+from sidecar_index import SidecarIndex
 
-__version__ = '2.0.2'
+__version__ = '2.5.0'
 
 logging.basicConfig(level=logging.INFO)
 
+def parse_resolution(value):
+    '''
+    argparse type for WxH resolution, returns (width, height)
+    '''
+    try:
+        width, height = (int(v) for v in value.lower().split('x'))
+        if width > 0 and height > 0:
+            return width, height
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError('resolution must be WIDTHxHEIGHT, eg 3840x2160, not: {}'.format(value))
+
 def parseargs():
     # Add command line argument parsing
     parser = argparse.ArgumentParser(description='Async Art gallery for Samsung Frame TV Version: {}'.format(__version__))
@@ -50,21 +89,39 @@ def parseargs():
                                                                 'united', 'vapour', 'yeti', 'zephyr', 'dark'],
                                          help='theme to apply to display (default: %(default)s))')
     parser.add_argument('-ph','--photographer', action="store", type=str, default="Paul Thompsen", help='default photographer to use (default: %(default)s))')
+    parser.add_argument('-ts','--thumbnail_size', action="store", type=int, default=960, help='max width/height of thumbnails shown on the web page (default: %(default)s))')
     parser.add_argument('-sf','--serif_font', action='store_true', default=False, help='use Serif Font for caption display (default: %(default)s))')
     parser.add_argument('-s','--sync', action='store_false', default=True, help='automatically syncronize (needs Pil library) (default: %(default)s))')
+    parser.add_argument('-sb','--sync_budget', action="store", type=float, default=0.5, help='fraction of time spent syncronizing at startup, 1=as fast as possible (default: %(default)s))')
+    parser.add_argument('-cm','--compare', default='hash', choices=['hash', 'batch'], help='how to compare files with TV thumbnails when syncronizing, batch needs numpy (default: %(default)s))')
+    parser.add_argument('-R','--reconcile', action="store", type=int, default=60, help='how often to poll TV state, in case TV events are missed (seconds) (default: %(default)s))')
+    parser.add_argument('-lt','--listing_ttl', action="store", type=int, default=300, help='how often to refresh the lists of My Photos and Favourites from the TV (seconds) (default: %(default)s))')
+    parser.add_argument('-w','--workers', action="store", type=int, default=None, help='number of worker processes for image processing, 0=use threads (default: number of cpus)')
+    parser.add_argument('-wq','--worker_queue', action="store", type=int, default=32, help='max number of jobs queued for the workers (default: %(default)s))')
+    parser.add_argument('-pl','--probe_limit', action="store", type=int, default=100, help='max number of image probes (exif and comparison frame) held in memory (default: %(default)s))')
+    parser.add_argument('-ul','--upload_limit', action="store", type=int, default=1, help='max number of uploads to the TV at the same time (default: %(default)s))')
+    parser.add_argument('-tc','--transcode', action='store_true', default=False, help='convert images to jpeg at the TV resolution before uploading (needs Pil library) (default: %(default)s))')
+    parser.add_argument('-tr','--resolution', action="store", type=parse_resolution, default='3840x2160', help='TV resolution used when transcoding (default: %(default)s))')
+    parser.add_argument('-cs','--cache_size', action="store", type=int, default=0, help='max number of images kept on the TV, images are uploaded when needed, 0=upload all (default: %(default)s))')
+    parser.add_argument('-pf','--prefetch', action="store", type=int, default=2, help='number of upcoming slideshow images uploaded in advance when using cache_size (default: %(default)s))')
     parser.add_argument('-K','--kiosk', action='store_true', default=False, help='Show in Kiosk mode (default: %(default)s))')
     parser.add_argument('-P','--production', action='store_true', default=False, help='Run in Production server mode (default: %(default)s))')
     parser.add_argument('-A','--art_mode', action='store_true', default=False, help='Ensure TV stays in art mode (except when off) (default: %(default)s))')
     parser.add_argument('-S','--sequential', action='store_true', default=False, help='sequential slide show (default: %(default)s))')
+    parser.add_argument('-so','--order', default='name', choices=['name', 'date'], help='order of sequential slide show, by file name, or date taken (default: %(default)s))')
     parser.add_argument('-O','--on', action='store_true', default=False, help='exit if TV is off (default: %(default)s))')
     parser.add_argument('-F','--favourite', action='store_true', default=False, help='include favourites in rotation (default: %(default)s))')
     parser.add_argument('-X','--exif', action='store_false', default=True, help='Use Exif data (default: %(default)s))')
+    parser.add_argument('-gc','--geocoder', default='nominatim', choices=['nominatim', 'offline', 'none'], help='how to find the address of GPS locations, offline needs a places file (-gd) (default: %(default)s))')
+    parser.add_argument('-gd','--geodata', action="store", type=str, default=None, help='GeoNames places file for the offline geocoder, eg cities1000.txt (default: %(default)s))')
+    parser.add_argument('-gp','--geo_precision', action="store", type=int, default=3, help='decimal places of GPS locations that share a cached address, 3 is about 100m (default: %(default)s))')
     parser.add_argument('-D','--debug', action='store_true', default=False, help='Debug mode (default: %(default)s))')
     return parser.parse_args()
 
 class WebServer(monitor_and_display):
     
     macro = {'modal': 'render_modal', 'caption': 'render_caption'}
+    send_timeout = 10   #disconnect websocket if a send takes longer than this (seconds)
     
     def __init__(self,     ip,
                            folder,
@@ -78,12 +135,29 @@ class WebServer(monitor_and_display):
                            on=False,
                            token_file=None,
                            art_mode = False,
+                           compare = 'hash',
+                           workers = None,
+                           worker_queue = 32,
+                           reconcile = 60,
+                           upload_limit = 1,
+                           transcode = False,
+                           resolution = (3840, 2160),
+                           cache_size = 0,
+                           prefetch = 2,
+                           order = 'name',
+                           listing_ttl = 300,
+                           sync_budget = 0.5,
+                           probe_limit = 100,
                            port=5000,
                            modal_size = '',
                            photographer = None,
                            theme = None,
                            serif_font = False,
                            exif = True,
+                           geocoder = 'nominatim',
+                           geodata = None,
+                           geo_precision = 3,
+                           thumbnail_size = 960,
                            kiosk=False):
         super().__init__(  ip,
                            folder,
@@ -96,7 +170,20 @@ class WebServer(monitor_and_display):
                            sequential      = sequential,
                            on              = on,
                            token_file      = token_file,
-                           art_mode        = art_mode)
+                           art_mode        = art_mode,
+                           compare         = compare,
+                           workers         = workers,
+                           worker_queue    = worker_queue,
+                           reconcile       = reconcile,
+                           upload_limit    = upload_limit,
+                           transcode       = transcode,
+                           resolution      = resolution,
+                           cache_size      = cache_size,
+                           prefetch        = prefetch,
+                           order           = order,
+                           listing_ttl     = listing_ttl,
+                           sync_budget     = sync_budget,
+                           probe_limit     = probe_limit)
         self.log = logging.getLogger('Main.'+__class__.__name__)
         self.debug = self.log.getEffectiveLevel() <= logging.DEBUG
         self.host = '0.0.0.0'   #allow connection from any computer
@@ -108,19 +195,43 @@ class WebServer(monitor_and_display):
         self.kiosk = kiosk
         self.connected = set()
         self.exit = False
-        self.text = {}
+        self.rendered = {}      #(name, type, modal_size): (source key, rendered window data)
+        self.render_task = None
         self.screens = []
         self.ws_id = 0
+        self.hub = Hub()
+        self.poll_task = None
         self.add_signals()
-        self.exif = ExifData(folder if exif else None, ip, self)
+        self.thumbnails = ThumbnailCache(folder, size=thumbnail_size)
+        self.probe.thumbnails = self.thumbnails     #make thumbnails when images are probed
+        self.exif = ExifData(folder if exif else None, ip, self, geocoder=geocoder, geodata=geodata, geo_precision=geo_precision)
         self.app = Quart(__name__, static_folder=folder)
+        self.sidecars = SidecarIndex(folder, loads=self.app.json.loads)
         self.bootstrap = Bootstrap5(self.app)
         if self.theme != 'dark':    #dark is not an actual theme, but a manual setting
             self.app.config['BOOTSTRAP_BOOTSWATCH_THEME'] = self.theme
         self.app.add_url_rule('/','show_thumbnails', self.show_thumbnails)
         self.app.add_url_rule('/caption','show_caption', self.show_caption)
+        self.app.add_url_rule('/thumbnail/<path:filename>','show_thumbnail', self.show_thumbnail)
+        self.app.add_url_rule('/stats','show_stats', self.show_stats)
         self.app.add_websocket('/ws', 'ws', self.ws)
         
+    async def initialize(self):
+        '''
+        wait for exif data to load first, if it is needed to sort the slideshow
+        '''
+        if self.order == 'date':
+            await self.exif.load_task
+        await super().initialize()
+        
+    def get_sort_key(self, item):
+        '''
+        sort slideshow by date taken from exif data, if there is one
+        '''
+        if self.order == 'date' and self.exif.get_date_original(item):
+            return self.exif.get_date_original(item)
+        return super().get_sort_key(item)
+        
     async def initialize_screens(self):
         '''
         initiialize caption and display screens if present
@@ -138,6 +249,7 @@ class WebServer(monitor_and_display):
         start everything up in either development or production environment
         '''
         await self.initialize_screens()
+        self.poll_task = asyncio.create_task(self.broadcast_tv_filename())
         if production:
             self.log.info('PRODUCTION Mode')
             config = Config()
@@ -191,10 +303,30 @@ class WebServer(monitor_and_display):
         
     async def sending(self):
         '''
-        websocket send - update web page with displayed filename on TV
+        websocket send - writer task that sends everything in this websocket's queue
+        filename changes are put on the queue by the hub (published by broadcast_tv_filename),
+        and replies to requests by ws_send
+        disconnects the websocket if the client falls too far behind
         '''
         self.log.info('websocket sending started')
-        await self.broadcast_tv_filename()  
+        websoc = self.get_ws()
+        while not self.exit:
+            data = await websoc.queue.get()
+            if data is None:
+                self.log.warning('WS({}): send queue overflow, disconnecting: {}'.format(websoc.id, websoc.queue.stats()))
+                break
+            if data.get('type') == 'update':
+                if websoc.skip:
+                    self.log.info('WS({}): will be skipping: {}'.format(websoc.id, websoc.skip))
+                if data['name'] in websoc.skip:         #skip if image was previously requested, as modal is already displayed
+                    self.log.info('WS({}): Not sending {} as image was previously selected'.format(websoc.id, data['name']))
+                    websoc.skip.discard(data['name'])
+                    continue
+            try:
+                await asyncio.wait_for(websoc.send_json(data), self.send_timeout)
+            except asyncio.TimeoutError:
+                self.log.warning('WS({}): send timed out, disconnecting'.format(websoc.id))
+                break
         self.log.warning('websocket sending ended')
 
     async def receiving(self):
@@ -209,23 +341,20 @@ class WebServer(monitor_and_display):
         
     async def broadcast_tv_filename(self):
         '''
-        broadcast filename changes to all websockets connected
+        single background task that polls the TV for filename changes, and publishes them to the hub
+        so the TV is polled once, however many websockets are connected
         '''
-        data={'type':'update'}
-        filename = self.filename_changed()              #filename generator
+        self.log.info('TV filename poller started')
         while not self.exit:
-            #stream filename changes on TV to web page
-            data['name'] = await anext(filename)        #blocks until next filename is available
-            for screen in self.screens:
-                await self.caption_screen_control(data['name']!='off', screen=screen.split(' ')[0])
-            for websoc in self.connected:
-                if websoc.skip:
-                    self.log.info('WS({}): will be skipping: {}'.format(websoc.id, websoc.skip))
-                if data['name'] in websoc.skip:         #skip if image was previously requested, as modal is already displayed
-                    self.log.info('WS({}): Not sending {} as image was previously selected'.format(websoc.id, data['name']))
-                    websoc.skip.discard(data['name'])
-                    continue
-                await self.ws_send(data, websoc)
+            try:
+                async for name in self.filename_changed():      #blocks until next filename is available
+                    for screen in self.screens:
+                        await self.caption_screen_control(name!='off', screen=screen.split(' ')[0])
+                    self.hub.publish({'type':'update', 'name': name})
+            except Exception as e:
+                self.log.exception(e)
+                await asyncio.sleep(5)
+        self.log.info('TV filename poller ended')
         
     async def ws_process(self, data):
         '''
@@ -263,7 +392,35 @@ class WebServer(monitor_and_display):
                 
     async def get_window_data(self, name, type='modal'):
         '''
-        get html to send to caption or modal windows using macro filled in from text data
+        get html to send to caption or modal windows, from the rendered cache if nothing it was made from has changed
+        '''
+        key = (name, type, self.modal_size)
+        source = self.get_source_key(name)
+        cached = self.rendered.get(key)
+        if source and cached and cached[0] == source:
+            return cached[1]
+        send_data = await self.render_window_data(name, type)
+        if source:
+            self.rendered[key] = (source, send_data)
+        return send_data
+        
+    def get_source_key(self, name):
+        '''
+        return key that changes when anything the modal or caption for image name is made from changes
+        ie the image or text file is modified, or the exif data (or address) is updated
+        returns None if the image can't be found
+        '''
+        try:
+            text_file = self.get_text_file_name(name)
+            return (get_stat_key(Path(self.app.static_folder, name)),
+                    get_stat_key(text_file) if text_file else None,
+                    self.exif.get_version(name))
+        except OSError:
+            return None
+            
+    async def render_window_data(self, name, type='modal'):
+        '''
+        render html to send to caption or modal windows using macro filled in from text data
         '''
         text = self.get_text(name, type=type)
         send_data = {'type':type, 'name': 'none'}
@@ -275,13 +432,13 @@ class WebServer(monitor_and_display):
         
     async def ws_send(self, data, websoc=None):
         '''
-        send json to websocket
+        queue json to send to websocket, the websocket sending task does the actual send
         '''
         ws = websoc or self.get_ws()
         if not self.debug:
             self.log.info('WS({}): sending: type: {}, name: {}'.format(ws.id, data.get('type'), data.get('name', data)))
         self.log.debug('WS({}): sending: {}'.format(ws.id, data))
-        await ws.send_json(data)
+        ws.queue.put(data)
             
     def get_ws(self):
         '''
@@ -299,11 +456,14 @@ class WebServer(monitor_and_display):
             self.connected.add(websoc)
             websoc.skip = set()
             websoc.id = self.ws_id
+            websoc.queue = self.hub.subscribe(websoc.id)
             self.log.info('{} websocket connected'.format(len(self.connected)))
             await self.ws_process({'type': 'refresh'})  #send 'refresh' to update display on first connection
             producer = asyncio.create_task(self.sending())
             consumer = asyncio.create_task(self.receiving())
-            await asyncio.gather(producer, consumer)
+            done, pending = await asyncio.wait([producer, consumer], return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()                           #raise any exception
         except asyncio.exceptions.CancelledError:
             self.log.info('WS({}): websocket cancelled'.format(websoc.id))
         except Exception as e:
@@ -315,9 +475,16 @@ class WebServer(monitor_and_display):
                 producer.cancel()
             except Exception:
                 pass
+            self.hub.unsubscribe(websoc.queue)
             self.connected.discard(websoc)
         self.log.warning('WS({}): websocket closed'.format(websoc.id))
         
+    async def show_stats(self):
+        '''
+        return websocket send queue depth and drop counters as json
+        '''
+        return {'connected': len(self.connected), 'queues': self.hub.stats()}
+        
     async def show_caption(self):
         '''
         show caption screen
@@ -330,11 +497,56 @@ class WebServer(monitor_and_display):
         construct thumbnail page from files in static folder
         '''
         self.log.info('loading thumnail page')
-        image_names = self.get_folder_files()
-        self.exif.get_files(self.get_modified_files())
+        image_names = await self.get_folder_files()
+        await self.exif.get_files(self.get_modified_files())
         self.log.info('displaying Buttons for: {}'.format(image_names))
         return await render_template('home.html', names=image_names, kiosk=str(self.kiosk).lower())
         
+    async def show_thumbnail(self, filename):
+        '''
+        serve thumbnail of filename from the thumbnail cache, or the original image if there is no thumbnail
+        '''
+        path = await self.pool.run_io(self.thumbnails.get, filename) if Path(filename).name == filename else None
+        if path:
+            return await send_from_directory(self.thumbnails.cache_dir, path.name, mimetype='image/jpeg')
+        return await send_from_directory(self.app.static_folder, filename)
+        
+    async def files_changed(self, files):
+        '''
+        called from check_dir when files in the folder have been added, removed or modified
+        the modal and caption html for changed files is rendered in the background, so it's ready when needed
+        '''
+        await self.pool.run_io(self.thumbnails.prune, files)
+        self.sidecars.refresh(True)
+        names = set(files)
+        self.rendered = {k: v for k, v in self.rendered.items() if k[0] in names}
+        modified = self.get_modified_files()
+        await self.exif.get_files(modified)
+        if self.order == 'date':
+            self.deck.rekey(modified)       #exif date may have changed
+        if self.render_task and not self.render_task.done():
+            self.render_task.cancel()
+        self.render_task = asyncio.create_task(self.prerender(files))
+        
+    async def prerender(self, files):
+        '''
+        render modal and caption html for files that are not already in the rendered cache (or have changed)
+        '''
+        try:
+            await self.exif.load_task       #so the html isn't rendered before the exif data is loaded
+            async with self.app.test_request_context('/'):      #needed for url_for in the macros
+                for name in files:
+                    for type in self.macro.keys():
+                        if self.exit:
+                            return
+                        await self.get_window_data(name, type)
+                        await asyncio.sleep(0)      #let everything else run
+            self.log.info('rendered html for {} files'.format(len(files)))
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.log.warning('error rendering html: {}'.format(e))
+        
     async def get_connected_screens_status(self, screen=None):
         '''
         detect attached screens if screen is None, or
@@ -417,41 +629,27 @@ class WebServer(monitor_and_display):
     def get_text_file_name(self, file):
         '''
         find text file name from image file name
-        case insensitive
+        case insensitive, uses the sidecar index, so the folder is not searched
         '''
-        text_file = Path(file).with_suffix(".TXT")
-        for file in Path(self.app.static_folder).iterdir():
-            if file.name.upper() == text_file.name.upper():
-                return file
-        return None
+        return self.sidecars.get(file)
         
     def get_text(self, file, type='modal'):
         '''
         takes an image file name, finds corresponding text file.
-        if data does not already exist in self.text and file has not been updated, reads the file from the static folder
-        as a dictionary of the json.
+        the text file is read from the static folder as a dictionary of the json, if it has not already been read
+        (or has been updated). If there is no text file, only the exif data is used.
         returns None if file not found, or json is invalid and data not in the image exif data
         returns caption data or modal data built from the text or exif data
         '''
         #default info
         data = {"id": Path(file).with_suffix(""), "name": file}
         text = {}
-        text_file = self.get_text_file_name(file)
-        if text_file:
-            try:
-                ts = self.get_last_updated(text_file)
-                if self.text.get(file,{}).get('timestamp') != ts:
-                    self.log.info('reading text file: {}'.format(text_file.name))
-                    text = self.app.json.loads(text_file.read_text())
-                    text['timestamp'] = ts
-                    self.text[file] = text
-                else:
-                    text = self.text.get(file,{})
+        try:
+            text = dict(self.sidecars.read(file))      #copy, so the cached data is not changed
+            if text:
                 self.log.debug('got text for image: {}: {}'.format(file, text))
-            except FileNotFoundError:
-                pass
-            except Exception as e:
-                self.log.warning('error: {}: {}'.format(e, text_file))
+        except Exception as e:
+            self.log.warning('error: {}: {}'.format(e, self.get_text_file_name(file)))
         #Python 3.10 onwards only!
         match type:
             case 'modal':
@@ -562,12 +760,29 @@ async def main():
                      on              = args.on,
                      token_file      = args.token_file,
                      art_mode        = args.art_mode,
+                     compare         = args.compare,
+                     workers         = args.workers,
+                     worker_queue    = args.worker_queue,
+                     reconcile       = args.reconcile,
+                     upload_limit    = args.upload_limit,
+                     transcode       = args.transcode,
+                     resolution      = args.resolution,
+                     cache_size      = args.cache_size,
+                     prefetch        = args.prefetch,
+                     order           = args.order,
+                     listing_ttl     = args.listing_ttl,
+                     sync_budget     = args.sync_budget,
+                     probe_limit     = args.probe_limit,
                      port            = args.port,
                      modal_size      = args.modal,
                      photographer    = args.photographer,
                      theme           = args.theme,
                      serif_font      = args.serif_font,
                      exif            = args.exif,
+                     geocoder        = args.geocoder,
+                     geodata         = args.geodata,
+                     geo_precision   = args.geo_precision,
+                     thumbnail_size  = args.thumbnail_size,
                      kiosk           = args.kiosk)
     
     await web.serve_forever(args.production)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# worker pool to keep blocking work off the asyncio event loop
+# processes are used for CPU bound work (image decode, blur, hash), threads for plain I/O
+# the number of jobs waiting or running is bounded, and pending jobs are cancelled on close()
+# jobs cancelled by close() (or started after it) raise PoolClosed, so callers can handle it like any other error
+
+import asyncio
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import logging
+
+__version__ = '1.0.1'
+
+logging.basicConfig(level=logging.INFO)
+
+class PoolClosed(Exception):
+    '''
+    worker pool has been closed
+    '''
+
+class WorkerPool:
+
+    def __init__(self, processes=None, threads=4, max_pending=32):
+        '''
+        processes: number of worker processes, None for number of cpus, 0 to use threads for everything
+        threads: number of worker threads
+        max_pending: max number of jobs queued or running at once, more jobs wait until there is room
+        '''
+        self.log = logging.getLogger('Main.'+__class__.__name__)
+        self.processes = os.cpu_count() if processes is None else processes
+        self.threads = threads
+        self.slots = asyncio.Semaphore(max_pending)
+        self.pending = set()
+        self.closed = False
+        self.process_pool = None
+        self.thread_pool = ThreadPoolExecutor(self.threads, thread_name_prefix='worker')
+        self.log.info('using {} worker processes and {} threads'.format(self.processes, self.threads))
+
+    def get_process_pool(self):
+        '''
+        start process pool on first use
+        spawn is used, as forking a process with a running event loop is not safe
+        '''
+        if not self.processes:
+            return self.thread_pool
+        if not self.process_pool:
+            self.process_pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('spawn'))
+        return self.process_pool
+
+    async def run_cpu(self, func, *args):
+        '''
+        run func(*args) in a worker process, func and args must be picklable (ie module level functions)
+        '''
+        return await self.run(self.get_process_pool(), func, *args)
+
+    async def run_io(self, func, *args):
+        '''
+        run func(*args) in a worker thread
+        '''
+        return await self.run(self.thread_pool, func, *args)
+
+    async def run(self, executor, func, *args):
+        '''
+        run func(*args) in executor, waiting for a free slot first
+        raises PoolClosed if the pool is closed
+        '''
+        async with self.slots:
+            if self.closed:
+                raise PoolClosed('worker pool closed')
+            future = asyncio.get_running_loop().run_in_executor(executor, func, *args)
+            self.pending.add(future)
+            try:
+                return await future
+            except asyncio.CancelledError:
+                if self.closed and future.cancelled():
+                    raise PoolClosed('worker pool closed') from None
+                raise
+            finally:
+                self.pending.discard(future)
+
+    async def map(self, coro_func, items):
+        '''
+        run coro_func(item) for all items concurrently (limited by max_pending)
+        returns dictionary of item: result, items that raise an exception are logged and left out
+        '''
+        results = await asyncio.gather(*[coro_func(item) for item in items], return_exceptions=True)
+        ok = {}
+        for item, result in zip(items, results):
+            if isinstance(result, (asyncio.CancelledError, PoolClosed)):
+                raise result
+            if isinstance(result, Exception):
+                self.log.warning('Error processing: {}, {}'.format(item, result))
+            else:
+                ok[item] = result
+        return ok
+
+    def close(self):
+        '''
+        cancel pending jobs and shut down workers
+        '''
+        if self.closed:
+            return
+        self.log.info('closing worker pool, cancelling {} jobs'.format(len(self.pending)))
+        self.closed = True
+        for future in self.pending:
+            future.cancel()
+        for pool in [self.process_pool, self.thread_pool]:
+            if pool:
+                pool.shutdown(wait=False, cancel_futures=True)